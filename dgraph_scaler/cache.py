@@ -0,0 +1,67 @@
+import hashlib
+import math
+import os
+from typing import Callable
+
+import numpy as np
+
+from dgraph_scaler import mpi
+from dgraph_scaler.graph import LocalGraph
+from dgraph_scaler.util import MAX_VERTEX, LoadedInput, PartitionMap
+
+CACHE_VERSION = 1  # Bumped whenever the stored layout changes, so stale entries are never read
+
+# Last input loaded by this process, by cache key. Only one is kept, as a partition can take most of the rank's memory.
+memory = {}
+
+
+def load_cached(input_file: str, cache_dir: str, balance: bool, loader: Callable[[], LoadedInput]) -> LoadedInput:
+    # Every rank keeps its parsed partition on disk, keyed by the input file and the rank count. The cache is only
+    # used if every rank has its part, otherwise all of them load the input again.
+    key = cache_key(input_file, balance)
+    if key in memory:
+        return memory[key]
+    memory.clear()  # Released before loading, so two inputs are never held at once
+    path = os.path.join(cache_dir, key, "rank{}.npz".format(mpi.rank))
+    if mpi.allreduce_sum([int(os.path.exists(path))])[0] == mpi.size:
+        loaded = read_partition(path)
+    else:
+        loaded = loader()
+        write_partition(path, loaded)
+    memory[key] = loaded
+    return loaded
+
+
+def clear():
+    # Drops the input kept in memory, the on-disk partitions stay
+    memory.clear()
+
+
+def cache_key(input_file: str, balance: bool) -> str:
+    stat = os.stat(input_file)
+    description = "{}|{}|{}|{}|{}|{}".format(os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns, mpi.size,
+                                             balance, CACHE_VERSION)
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+def read_partition(path: str) -> LoadedInput:
+    with np.load(path) as data:
+        partition_map = [(first, last) for first, last in zip(data["firsts"].tolist(), data["lasts"].tolist())]
+        first, last = partition_map[-1]
+        partition_map[-1] = (first, math.inf if last == MAX_VERTEX else last)
+        return LoadedInput(LocalGraph(data["sources"], data["targets"]), PartitionMap(partition_map),
+                           int(data["total_nodes"]))
+
+
+def write_partition(path: str, loaded: LoadedInput):
+    # Written under a temporary name and renamed, so a partially written file is never taken as cached
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as file:
+        np.savez(file, sources=loaded.graph.sources, targets=loaded.graph.targets,
+                 firsts=loaded.partition_map.firsts, lasts=loaded.partition_map.lasts,
+                 total_nodes=loaded.total_nodes)
+    os.replace(path + ".tmp", path)
+
+
+def clear():
+    memory.clear()
@@ -0,0 +1,42 @@
+import numpy as np
+
+VARINT_BITS = 7
+VARINT_MASK = (1 << VARINT_BITS) - 1
+VARINT_MORE = 1 << VARINT_BITS
+
+
+def encode_set(values: np.ndarray) -> np.ndarray:
+    # Sorted values are stored as the varint-encoded gaps between them
+    values = np.unique(values)
+    return encode_varint(np.diff(values, prepend=0).astype(np.uint64))
+
+
+def decode_set(data: np.ndarray) -> np.ndarray:
+    return np.cumsum(decode_varint(data)).astype(np.int64)
+
+
+def encode_varint(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.uint64, copy=False)
+    lengths = np.ones(len(values), dtype=np.int64)
+    remaining = values >> np.uint64(VARINT_BITS)
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= np.uint64(VARINT_BITS)
+    starts = np.cumsum(lengths) - lengths
+    data = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for byte in range(int(lengths.max()) if len(values) else 0):
+        active = np.flatnonzero(lengths > byte)
+        chunk = (values[active] >> np.uint64(VARINT_BITS * byte)) & np.uint64(VARINT_MASK)
+        more = (lengths[active] > byte + 1).astype(np.uint64) * np.uint64(VARINT_MORE)
+        data[starts[active] + byte] = chunk | more
+    return data
+
+
+def decode_varint(data: np.ndarray) -> np.ndarray:
+    if not len(data):
+        return np.empty(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < VARINT_MORE)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    chunks = (data & VARINT_MASK).astype(np.uint64) << (shifts * VARINT_BITS).astype(np.uint64)
+    return np.add.reduceat(chunks, starts)
@@ -0,0 +1,54 @@
+from typing import List
+
+import numpy as np
+
+from dgraph_scaler import mpi
+from dgraph_scaler.graph import LocalGraph, connected_components
+
+
+def connect_sample(sample: LocalGraph):
+    # Link the weakly connected components in a chain, which is the minimum amount of bridges
+    vertices = sample.nodes
+    components = connected_components(*sample.endpoint_indices, len(vertices))
+    representatives = vertices[np.unique(components)]
+    sample.add_edges(representatives[:-1], representatives[1:])
+
+
+def connect_distributed(samples: List[LocalGraph]):
+    # Step 1: Local components of the rank's edges, labeled with their smallest vertex
+    graph = LocalGraph(np.concatenate([sample.sources for sample in samples]),
+                       np.concatenate([sample.targets for sample in samples]))
+    vertices = graph.nodes
+    components = connected_components(*graph.endpoint_indices, len(vertices))
+    labels = vertices.copy()  # Label of every local root, which is its vertex as roots are the smallest indices
+    # Step 2: Propagate the smallest label through the vertices shared between ranks, until no label changes
+    homes = vertices % mpi.size
+    order = np.argsort(homes, kind="stable")
+    send_counts = np.bincount(homes, minlength=mpi.size)
+    shared_vertices, recv_counts = mpi.alltoallv_buffer(vertices[order], send_counts)
+    changed = True
+    while changed:
+        remote_labels, _ = mpi.alltoallv_buffer(labels[components][order], send_counts, recv_counts=recv_counts)
+        min_labels, _ = mpi.alltoallv_buffer(min_per_vertex(shared_vertices, remote_labels), recv_counts,
+                                             recv_counts=send_counts)
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, components[order], min_labels)
+        changed = mpi.allreduce_sum([int((new_labels < labels).any())])[0] > 0
+        labels = new_labels
+    # Step 3: Chain the global components from the first rank
+    global_labels = np.unique(np.concatenate(mpi.gather(np.unique(labels[components]), root=0) or [labels[:0]]))
+    if mpi.rank == 0:
+        samples[0].add_edges(global_labels[:-1], global_labels[1:])
+
+
+def min_per_vertex(vertices: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    # Smallest label reported for every vertex, in the same order as the reports
+    if not len(vertices):
+        return labels.copy()
+    order = np.argsort(vertices, kind="stable")
+    sorted_vertices = vertices[order]
+    starts = np.flatnonzero(np.concatenate([[True], sorted_vertices[1:] != sorted_vertices[:-1]]))
+    group_min = np.minimum.reduceat(labels[order], starts)
+    min_labels = np.empty_like(labels)
+    min_labels[order] = np.repeat(group_min, np.diff(np.append(starts, len(vertices))))
+    return min_labels
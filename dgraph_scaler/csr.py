@@ -0,0 +1,122 @@
+import struct
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Binary CSR layout (little endian, every section 8-byte aligned):
+#   header      MAGIC, nodes amount, edges amount, vertices range (V), partitions amount (P)
+#   offsets     int64[V + 1], neighbors of vertex v are neighbors[offsets[v]:offsets[v + 1]]
+#   neighbors   int64[edges amount]
+#   boundaries  int64[P + 1], partition i owns the vertices in [boundaries[i], boundaries[i + 1])
+MAGIC = b"DGSCSR01"
+HEADER = struct.Struct("<8sqqqq")
+DTYPE = np.dtype("<i8")
+
+
+class CSRHeader:
+    def __init__(self, nodes_amount, edges_amount, vertices_range, partitions_amount):
+        self.nodes_amount = nodes_amount
+        self.edges_amount = edges_amount
+        self.vertices_range = vertices_range
+        self.partitions_amount = partitions_amount
+
+    @property
+    def offsets_start(self):
+        return HEADER.size
+
+    @property
+    def neighbors_start(self):
+        return self.offsets_start + (self.vertices_range + 1) * DTYPE.itemsize
+
+    @property
+    def boundaries_start(self):
+        return self.neighbors_start + self.edges_amount * DTYPE.itemsize
+
+
+def is_csr_file(input_file: str) -> bool:
+    with open(input_file, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_header(input_file: str) -> CSRHeader:
+    with open(input_file, "rb") as file:
+        magic, *fields = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Invalid CSR file: {}".format(input_file))
+    return CSRHeader(*fields)
+
+
+def write_csr(output_file: str, read_chunks: Callable[[], Iterator[Tuple[np.ndarray, np.ndarray]]],
+              nodes_amount: Optional[int], partitions_amount: int):
+    # The edges are read twice as (sources, targets) chunks, so only the offsets are held in memory. Without a known
+    # nodes amount, the distinct vertices are counted too.
+    # Step 1: Count the out-degrees
+    degrees = np.zeros(0, dtype=DTYPE)
+    seen = np.zeros(0, dtype=bool)
+    edges_amount = 0
+    for sources, targets in read_chunks():
+        if len(sources):
+            chunk_degrees = np.bincount(sources)
+            if len(chunk_degrees) > len(degrees):
+                degrees = np.concatenate([degrees, np.zeros(len(chunk_degrees) - len(degrees), dtype=DTYPE)])
+            degrees[:len(chunk_degrees)] += chunk_degrees
+            if nodes_amount is None:
+                vertices_end = int(max(sources.max(), targets.max())) + 1
+                seen = np.concatenate([seen, np.zeros(max(vertices_end - len(seen), 0), dtype=bool)])
+                seen[sources] = True
+                seen[targets] = True
+        edges_amount += len(sources)
+    if nodes_amount is None:
+        nodes_amount = int(np.count_nonzero(seen))
+        del seen
+    vertices_range = len(degrees)
+    offsets = np.zeros(vertices_range + 1, dtype=DTYPE)
+    np.cumsum(degrees, out=offsets[1:])
+    del degrees
+    header = CSRHeader(nodes_amount, edges_amount, vertices_range, partitions_amount)
+    with open(output_file, "wb") as file:
+        file.write(HEADER.pack(MAGIC, nodes_amount, edges_amount, vertices_range, partitions_amount))
+        file.write(offsets.tobytes())
+        file.truncate(header.boundaries_start)
+        file.seek(header.boundaries_start)
+        file.write(compute_boundaries(offsets, partitions_amount).tobytes())
+    # Step 2: Place every chunk's targets after the ones already placed for the same source, keeping the input order
+    if not edges_amount:
+        return
+    neighbors = np.memmap(output_file, dtype=DTYPE, mode="r+", offset=header.neighbors_start, shape=(edges_amount,))
+    filled = offsets[:-1].copy()
+    for sources, targets in read_chunks():
+        order = np.argsort(sources, kind="stable")
+        sorted_sources = sources[order]
+        counts = np.bincount(sorted_sources, minlength=vertices_range)
+        group_starts = (np.cumsum(counts) - counts)[sorted_sources]
+        neighbors[filled[sorted_sources] + np.arange(len(order)) - group_starts] = targets[order]
+        filled += counts
+    neighbors.flush()
+    del neighbors
+
+
+def compute_boundaries(offsets: np.ndarray, partitions_amount: int) -> np.ndarray:
+    # Balance partitions on edges amount, always splitting between source vertices
+    edge_splits = np.arange(partitions_amount + 1, dtype=DTYPE) * int(offsets[-1]) // partitions_amount
+    boundaries = np.searchsorted(offsets, edge_splits, side="left").astype(DTYPE)
+    boundaries[0], boundaries[-1] = 0, len(offsets) - 1
+    return boundaries
+
+
+def load_csr(input_file: str) -> Tuple[CSRHeader, np.memmap, np.memmap]:
+    header = read_header(input_file)
+    offsets = np.memmap(input_file, dtype=DTYPE, mode="r", offset=header.offsets_start,
+                        shape=(header.vertices_range + 1,))
+    neighbors = np.memmap(input_file, dtype=DTYPE, mode="r", offset=header.neighbors_start,
+                          shape=(header.edges_amount,))
+    return header, offsets, neighbors
+
+
+def load_boundaries(input_file: str, header: CSRHeader, offsets: np.ndarray, partitions_amount: int) -> List[int]:
+    if header.partitions_amount == partitions_amount:
+        boundaries = np.memmap(input_file, dtype=DTYPE, mode="r", offset=header.boundaries_start,
+                               shape=(header.partitions_amount + 1,))
+    else:
+        boundaries = compute_boundaries(offsets, partitions_amount)
+    return [int(b) for b in boundaries]
@@ -1,36 +1,142 @@
 import math
-from typing import List, Tuple
+import os
+import warnings
+from bisect import bisect_left
+from typing import BinaryIO, List, Optional, Tuple
 
-from dgraph_scaler.mpi import rank, size, comm
-from dgraph_scaler.typing import RawEdge
+import numpy as np
+
+from dgraph_scaler import mpi, csr
+from dgraph_scaler.graph import LocalGraph
 from dgraph_scaler.util import PartitionMap
 
+INDEX_EXTENSION = ".idx"
+
 
-def distribute_edges(input_file: str) -> Tuple[List[RawEdge], PartitionMap, int]:
-    with open(input_file) as file:
-        total_nodes_amount = int(file.readline().rstrip())
-        total_edges_amount = int(file.readline().rstrip())
-        edges_amount = [total_edges_amount // size] * size
-        for i in range(total_edges_amount % size):
-            edges_amount[i] += 1
-        forward_amount = sum(edges_amount[:rank])
-        for _ in range(forward_amount):
-            file.readline()
-        edges_buffer = [None] * (total_edges_amount // size + 1)
-        for i in range(edges_amount[rank]):
-            edges_buffer[i] = file.readline().rstrip()
-    my_mapping = (int(edges_buffer[0].split()[0]), int(edges_buffer[i].split()[0]))
-
-    raw_map = comm.alltoall([my_mapping] * (size))
+def distribute_edges(input_file: str) -> Tuple[bytes, PartitionMap, int]:
+    index = load_offset_index(input_file)
+    with open(input_file, "rb") as file:
+        total_nodes_amount = int(file.readline())
+        file.readline()  # Edges amount: ranges are balanced on bytes instead of lines
+        data_start = file.tell()
+        data_end = os.fstat(file.fileno()).st_size
+        # Step 1: Seek straight to the own byte range, aligned to source-vertex blocks
+        first, last = [find_partition_boundary(file, split_offset(data_start, data_end, partition), data_start,
+                                               data_end, index) for partition in (mpi.rank, mpi.rank + 1)]
+        file.seek(first)
+        # The range is kept as raw bytes, parsed at once into arrays by the caller
+        edges_data = file.read(last - first)
+    raw_map = mpi.allgather(range_sources(edges_data))
     raw_map = fill_map_gaps(raw_map)
-    return edges_buffer[:i + 1], PartitionMap(raw_map), total_nodes_amount
+    return edges_data, PartitionMap(raw_map), total_nodes_amount
+
+
+def range_sources(data: bytes) -> Optional[Tuple[int, int]]:
+    # Sources of the first and last edges, skipping surrounding blank lines without copying the data
+    start, end = 0, len(data)
+    while start < end and data[start:start + 1].isspace():
+        start += 1
+    while end > start and data[end - 1:end].isspace():
+        end -= 1
+    if start == end:
+        return None
+    first_end = data.find(b"\n", start, end)
+    first_line = data[start:first_end if first_end >= 0 else end]
+    last_line = data[data.rfind(b"\n", start, end) + 1:end]
+    return int(first_line.split()[0]), int(last_line.split()[0])
+
+
+def distribute_csr(input_file: str) -> Tuple[int, np.ndarray, np.ndarray, PartitionMap, int]:
+    header, offsets, neighbors = csr.load_csr(input_file)
+    boundaries = csr.load_boundaries(input_file, header, offsets, mpi.size)
+    # Slices of the memory-mapped arrays, nothing is read until it is accessed
+    first, last = boundaries[mpi.rank], boundaries[mpi.rank + 1]
+    my_offsets = offsets[first:last + 1]
+    my_neighbors = neighbors[my_offsets[0]:my_offsets[-1]]
+    raw_map = [(b_first, b_last - 1) for b_first, b_last in zip(boundaries, boundaries[1:])]
+    raw_map[-1] = (raw_map[-1][0], math.inf)
+    return first, my_offsets, my_neighbors, PartitionMap(raw_map), header.nodes_amount
+
+
+def split_offset(data_start: int, data_end: int, partition: int) -> int:
+    return data_start + (data_end - data_start) * partition // mpi.size
+
+
+def find_partition_boundary(file: BinaryIO, offset: int, data_start: int, data_end: int,
+                            index: Optional[List[int]]) -> int:
+    # Boundaries are the start of the first source-vertex block after the offset, so every rank computes the same
+    # boundary for the same offset and no source vertex is split between two ranks
+    if offset <= data_start:
+        return data_start
+    if offset >= data_end:
+        return data_end
+    if index is not None:
+        i = bisect_left(index, offset)
+        return index[i] if i < len(index) else data_end
+    file.seek(offset - 1)
+    file.readline()  # Realign to the next line
+    block_source = None
+    while True:
+        boundary = file.tell()
+        line = file.readline()
+        if not line:
+            return data_end
+        fields = line.split()
+        if not fields:
+            continue
+        source = int(fields[0])
+        if block_source is None:
+            block_source = source
+        elif source != block_source:
+            return boundary
+
+
+def rebalance(graph: LocalGraph) -> Tuple[LocalGraph, PartitionMap]:
+    # Moves whole source-vertex blocks between neighboring ranks so every rank gets the same estimated cost: the
+    # vertex, its edges, and the excess of its degree over the mean, as hubs also attract most induction queries
+    order = np.argsort(graph.sources, kind="stable")
+    sources, targets = graph.sources[order], graph.targets[order]
+    block_sources, degrees = np.unique(sources, return_counts=True)
+    vertices_amount, edges_amount = mpi.allreduce_sum([len(block_sources), len(sources)])
+    mean_degree = edges_amount / max(vertices_amount, 1)
+    costs = 1 + degrees + np.ceil(np.maximum(degrees - mean_degree, 0)).astype(np.int64)
+    # Step 1: Every block goes to the rank whose share of the global cost contains its middle
+    local_cost = int(costs.sum())
+    cost_ends = mpi.exscan_sum(local_cost) + np.cumsum(costs)
+    total_cost = max(mpi.allreduce_sum([local_cost])[0], 1)
+    destinations = np.minimum((2 * cost_ends - costs) * mpi.size // (2 * total_cost), mpi.size - 1)
+    # Step 2: Blocks are already grouped by destination, and ranks receive them in order
+    send_counts = np.bincount(np.repeat(destinations, degrees), minlength=mpi.size)
+    sources, _ = mpi.alltoallv_buffer(sources, send_counts)
+    targets, _ = mpi.alltoallv_buffer(targets, send_counts)
+    raw_map = mpi.allgather((int(sources[0]), int(sources[-1])) if len(sources) else None)
+    return LocalGraph(sources, targets), PartitionMap(fill_map_gaps(raw_map))
+
+
+def load_offset_index(input_file: str) -> Optional[List[int]]:
+    # Optional sidecar file with the (sorted) byte offsets where source-vertex blocks start, one per line, after a
+    # "# size mtime_ns" line stamping the input it was written for. An index of a different input is not used.
+    index_file = input_file + INDEX_EXTENSION
+    if not os.path.exists(index_file):
+        return None
+    stat = os.stat(input_file)
+    with open(index_file) as file:
+        if file.readline().split() != ["#", str(stat.st_size), str(stat.st_mtime_ns)]:
+            if mpi.rank == 0:
+                warnings.warn("Ignoring {}, it was not written for the current {}".format(index_file, input_file),
+                              RuntimeWarning)
+            return None
+        return [int(line) for line in file if line.strip()]
 
 
 def fill_map_gaps(raw_map):
     new_map = []
-    prev_last = 0
+    prev_last = -1
     for i, limit in enumerate(raw_map):
-        first, last = limit
+        if limit is None:  # Empty partition
+            first, last = prev_last + 1, prev_last
+        else:
+            first, last = limit
         if first > prev_last:
             first = prev_last + 1
         if i == len(raw_map) - 1:
@@ -0,0 +1,85 @@
+from math import ceil, log
+from typing import NamedTuple
+
+import numpy as np
+
+# 128 KiB per filter. Every rank receives the filters of all the others, 8 MiB per induction round with 64 ranks.
+DEFAULT_MAX_BITS = 1 << 20
+MIN_BITS = 64
+
+
+class FilterOptions(NamedTuple):
+    false_positive_rate: float = 0.01
+    max_bits: int = DEFAULT_MAX_BITS
+
+
+class FilterHeader(NamedTuple):
+    # Everything but the bits, small enough to be exchanged as a plain object
+    offset: int
+    bits_amount: int
+    hashes: int  # 0 for an exact bitmap
+    empty: bool
+
+
+class VertexFilter:
+    # Compact membership test of a vertex set, without false negatives. Dense sets are kept as an exact bitmap of
+    # their range, the rest as a Bloom filter sized for the false positive rate, up to max_bits.
+    def __init__(self, header: FilterHeader, bits: np.ndarray):
+        self.offset, self.bits_amount, self.hashes, self.empty = header
+        self.bits = bits
+
+    @staticmethod
+    def from_vertices(vertices: np.ndarray, options: FilterOptions) -> "VertexFilter":
+        offset = int(vertices[0]) if len(vertices) else 0
+        span = int(vertices[-1]) - offset + 1 if len(vertices) else 0
+        bloom_bits = ceil(-len(vertices) * log(options.false_positive_rate) / log(2) ** 2)
+        bloom_bits = min(max(bloom_bits, MIN_BITS), options.max_bits)
+        if span <= bloom_bits:
+            header = FilterHeader(offset, span, 0, not len(vertices))
+            positions = vertices - offset
+        else:
+            header = FilterHeader(offset, bloom_bits, max(1, round(bloom_bits / len(vertices) * log(2))), False)
+            positions = np.unique(hash_positions(vertices, header.hashes, header.bits_amount))
+        bits = np.zeros(ceil(header.bits_amount / 8), dtype=np.uint8)
+        for bit in range(8):
+            bits[positions[positions % 8 == bit] // 8] |= np.uint8(1 << bit)
+        return VertexFilter(header, bits)
+
+    @property
+    def header(self) -> FilterHeader:
+        return FilterHeader(self.offset, self.bits_amount, self.hashes, self.empty)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def contains(self, vertices: np.ndarray) -> np.ndarray:
+        if self.empty:
+            return np.zeros(len(vertices), dtype=bool)
+        if not self.hashes:
+            positions = vertices - self.offset
+            inside = (positions >= 0) & (positions < self.bits_amount)
+            found = np.zeros(len(vertices), dtype=bool)
+            found[inside] = self.test(positions[inside])
+            return found
+        return self.test(hash_positions(vertices, self.hashes, self.bits_amount)).reshape(self.hashes, -1).all(axis=0)
+
+    def test(self, positions: np.ndarray) -> np.ndarray:
+        return (self.bits[positions // 8] >> (positions % 8).astype(np.uint8)) & 1 == 1
+
+
+def hash_positions(vertices: np.ndarray, hashes: int, bits_amount: int) -> np.ndarray:
+    # Double hashing, the i-th hash of every vertex is h1 + i * h2
+    first = mix(vertices.astype(np.uint64))
+    second = mix(first ^ np.uint64(0x9E3779B97F4A7C15)) | np.uint64(1)
+    rounds = np.arange(hashes, dtype=np.uint64).reshape(-1, 1)
+    return ((first + rounds * second) % np.uint64(bits_amount)).astype(np.int64).ravel()
+
+
+def mix(values: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer, integer overflow wraps around
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
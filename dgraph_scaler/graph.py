@@ -0,0 +1,136 @@
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from dgraph_scaler.typing import Edge, Vertex
+
+VERTEX_DTYPE = np.int64
+
+
+class LocalGraph:
+    # Directed multigraph stored as two parallel arrays of edge endpoints. Edges are appended in chunks, which are
+    # concatenated lazily, and the sorted vertex set and sorted edge keys are cached until the next modification.
+    def __init__(self, sources: Optional[np.ndarray] = None, targets: Optional[np.ndarray] = None):
+        self._sources = []
+        self._targets = []
+        self._nodes = None
+        self._edge_keys = None
+        self._endpoint_indices = None
+        if sources is not None:
+            self.add_edges(sources, targets)
+
+    @staticmethod
+    def from_csr(first_vertex: Vertex, offsets: np.ndarray, neighbors: np.ndarray) -> "LocalGraph":
+        sources = np.repeat(np.arange(first_vertex, first_vertex + len(offsets) - 1, dtype=VERTEX_DTYPE),
+                            np.diff(offsets))
+        return LocalGraph(sources, neighbors)
+
+    @property
+    def sources(self) -> np.ndarray:
+        self._consolidate()
+        return self._sources[0]
+
+    @property
+    def targets(self) -> np.ndarray:
+        self._consolidate()
+        return self._targets[0]
+
+    @property
+    def edges(self) -> Iterator[Edge]:
+        return zip(self.sources.tolist(), self.targets.tolist())
+
+    @property
+    def nodes(self) -> np.ndarray:
+        if self._nodes is None:
+            self._nodes = np.unique(np.concatenate([self.sources, self.targets]))
+        return self._nodes
+
+    @property
+    def endpoint_indices(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Positions of the edges' endpoints in the sorted vertex array, for vertex-indexed masks
+        if self._endpoint_indices is None:
+            dtype = np.int32 if len(self.nodes) <= np.iinfo(np.int32).max else VERTEX_DTYPE
+            self._endpoint_indices = (np.searchsorted(self.nodes, self.sources).astype(dtype),
+                                      np.searchsorted(self.nodes, self.targets).astype(dtype))
+        return self._endpoint_indices
+
+    def number_of_nodes(self) -> int:
+        return len(self.nodes)
+
+    def number_of_edges(self) -> int:
+        return sum(map(len, self._sources))
+
+    def add_edges(self, sources: np.ndarray, targets: np.ndarray):
+        if len(sources) != len(targets):
+            raise ValueError("Sources and targets must have the same length")
+        self._sources.append(np.asarray(sources, dtype=VERTEX_DTYPE))
+        self._targets.append(np.asarray(targets, dtype=VERTEX_DTYPE))
+        self._nodes = None
+        self._edge_keys = None
+        self._endpoint_indices = None
+
+    def add_edges_from(self, edges: Iterable[Edge]):
+        edges = np.array(list(edges), dtype=VERTEX_DTYPE).reshape(-1, 2)
+        self.add_edges(edges[:, 0], edges[:, 1])
+
+    def shift(self, offset: int):
+        # Relabel every vertex v as v + offset, in place
+        self.sources[:] += offset
+        self.targets[:] += offset
+        if self._nodes is not None:
+            self._nodes += offset
+        self._edge_keys = None
+
+    def has_nodes(self, vertices: np.ndarray) -> np.ndarray:
+        return is_member(self.nodes, vertices)
+
+    def has_edges(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        # Edges are keyed by the positions of their endpoints in the sorted vertex array, which fit whatever the ids
+        if self._edge_keys is None:
+            self._edge_keys = np.unique(edge_keys(*self.endpoint_indices, self.number_of_nodes()))
+        source_positions, source_found = self.node_positions(sources)
+        target_positions, target_found = self.node_positions(targets)
+        keys = edge_keys(source_positions, target_positions, self.number_of_nodes())
+        return source_found & target_found & is_member(self._edge_keys, keys)
+
+    def node_positions(self, vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Position of every vertex in the sorted vertex array, and whether it is a vertex of the graph at all
+        if not self.number_of_nodes():
+            return np.zeros(len(vertices), dtype=VERTEX_DTYPE), np.zeros(len(vertices), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.nodes, vertices), self.number_of_nodes() - 1)
+        return positions, self.nodes[positions] == vertices
+
+    def _consolidate(self):
+        if len(self._sources) != 1:
+            self._sources = [np.concatenate(self._sources) if self._sources else np.empty(0, dtype=VERTEX_DTYPE)]
+            self._targets = [np.concatenate(self._targets) if self._targets else np.empty(0, dtype=VERTEX_DTYPE)]
+
+
+def edge_keys(source_positions: np.ndarray, target_positions: np.ndarray, nodes_amount: int) -> np.ndarray:
+    # Pack both endpoint positions into a single integer so edge sets can be sorted and searched as plain arrays
+    return source_positions.astype(np.uint64) * np.uint64(nodes_amount) + target_positions.astype(np.uint64)
+
+
+def is_member(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_values, values)
+    positions[positions == len(sorted_values)] = 0
+    return sorted_values[positions] == values
+
+
+def connected_components(sources: np.ndarray, targets: np.ndarray, vertices_amount: int) -> np.ndarray:
+    # Vectorized union-find: roots are hooked to the smallest neighboring root, then paths are fully compressed.
+    # Returns the root of every vertex, which is the smallest vertex index of its component.
+    parents = np.arange(vertices_amount)
+    while True:
+        source_roots, target_roots = parents[sources], parents[targets]
+        if (source_roots == target_roots).all():
+            return parents
+        lowest = np.minimum(source_roots, target_roots)
+        np.minimum.at(parents, source_roots, lowest)
+        np.minimum.at(parents, target_roots, lowest)
+        grandparents = parents[parents]
+        while (grandparents != parents).any():
+            parents = grandparents
+            grandparents = parents[parents]
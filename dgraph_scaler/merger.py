@@ -1,41 +1,246 @@
-from typing import List
+from enum import Enum
+from typing import BinaryIO, Iterator, List, Tuple
 
-import networkx as nx
+import numpy as np
 
 from dgraph_scaler import mpi
+from dgraph_scaler.graph import LocalGraph
+from dgraph_scaler.util import format_edges, split_by_destination
 
+FORMAT_EDGES = 4096  # Edges formatted at once when filling a chunk
+MAX_LINE_LENGTH = 42  # Bytes of a formatted edge between two 64-bit vertices
+CHUNK_SIZE = 16 * 1024 * 1024
+SPLITTER_SAMPLES = 64  # Sources sampled per rank for choosing the global sort splitters
 
-def merge_samples(samples: List[nx.MultiDiGraph], output_file: str, nfs: bool):
-    if nfs:
-        merge_nfs(samples, output_file)
+
+class MergeType(Enum):
+    CENTRALIZED = 0
+    NFS = 1
+    MPI_IO = 2
+
+    @staticmethod
+    def parse_type(raw_type: str):
+        if raw_type == "centralized":
+            return MergeType.CENTRALIZED
+        elif raw_type == "nfs":
+            return MergeType.NFS
+        elif raw_type == "mpi-io":
+            return MergeType.MPI_IO
+        else:
+            raise ValueError("Invalid merge type")
+
+
+def merge_samples(samples: List[LocalGraph], output_file: str, merge_type: MergeType, chunk_size: int = CHUNK_SIZE,
+                  header: bool = False, pipelined: bool = False):
+    if header and merge_type != MergeType.MPI_IO:
+        raise ValueError("The merge header can only be written by the mpi-io merge")
+    if merge_type == MergeType.CENTRALIZED:
+        merge_centralized(samples, output_file, chunk_size, pipelined)
+    elif merge_type == MergeType.NFS:
+        merge_nfs(samples, output_file, chunk_size)
+    elif merge_type == MergeType.MPI_IO:
+        merge_mpiio(samples, output_file, chunk_size, header)
     else:
-        merge_centralized(samples, output_file)
+        raise ValueError("Invalid merge type")
+
+
+class StreamMerger:
+    # Writes the output incrementally, one batch of edges at a time. The centralized and MPI-IO merges are collective,
+    # so every rank must write the same amount of batches. The nfs merge writes a single file per rank.
+    def __init__(self, output_file: str, merge_type: MergeType, chunk_size: int = CHUNK_SIZE, pipelined: bool = False):
+        self.merge_type = merge_type
+        self.chunk_size = chunk_size
+        self.pipelined = pipelined
+        self.offset = 0
+        if merge_type == MergeType.CENTRALIZED:
+            self.file = open("{}.txt".format(output_file), "wb") if mpi.rank == 0 else None
+        elif merge_type == MergeType.NFS:
+            self.file = open("{}.{}.txt".format(output_file, mpi.rank), "wb")
+        elif merge_type == MergeType.MPI_IO:
+            self.file = mpi.CollectiveFile("{}.txt".format(output_file))
+        else:
+            raise ValueError("Invalid merge type")
+
+    def write(self, sources: np.ndarray, targets: np.ndarray):
+        batch = [LocalGraph(sources, targets)]
+        if self.merge_type == MergeType.CENTRALIZED:
+            if mpi.rank == 0:
+                gather_chunks(self.file, batch, self.chunk_size, self.pipelined)
+            else:
+                merge_samples_follower(batch, self.chunk_size, self.pipelined)
+        elif self.merge_type == MergeType.NFS:
+            for chunk in edge_chunks(batch, self.chunk_size):
+                self.file.write(chunk)
+        else:
+            self.offset = write_collective(self.file, self.offset, batch[0].sources, batch[0].targets,
+                                           self.chunk_size)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
 
+    def __enter__(self):
+        return self
 
-def merge_nfs(samples: List[nx.MultiDiGraph], output_file: str):
+    def __exit__(self, *_):
+        self.close()
+
+
+def merge_nfs(samples: List[LocalGraph], output_file: str, chunk_size: int):
     for i, sample in enumerate(samples):
-        nx.write_edgelist(sample, "{}.{}.{}.txt".format(output_file, mpi.rank, i), data=False)
+        with open("{}.{}.{}.txt".format(output_file, mpi.rank, i), "wb") as file:
+            for chunk in edge_chunks([sample], chunk_size):
+                file.write(chunk)
 
 
-def merge_centralized(samples: List[nx.MultiDiGraph], output_file: str):
+def merge_centralized(samples: List[LocalGraph], output_file: str, chunk_size: int, pipelined: bool = False):
     if mpi.rank == 0:
-        merge_samples_master(samples, output_file)
+        merge_samples_master(samples, output_file, chunk_size, pipelined)
     else:
-        merge_samples_follower(samples)
+        merge_samples_follower(samples, chunk_size, pipelined)
+
+
+def merge_samples_master(samples: List[LocalGraph], output_file: str, chunk_size: int, pipelined: bool = False):
+    with open("{}.txt".format(output_file), "wb") as file:
+        gather_chunks(file, samples, chunk_size, pipelined)
+
+
+def gather_chunks(file: BinaryIO, samples: List[LocalGraph], chunk_size: int, pipelined: bool = False):
+    if pipelined:
+        gather_chunks_pipelined(file, samples, chunk_size)
+        return
+    for chunk in edge_chunks(samples, chunk_size):
+        file.write(chunk)
+    # Chunks are written in arrival order, an empty chunk marks a finished follower
+    followers = mpi.size - 1
+    while followers:
+        _, chunk = mpi.recv_bytes(tag=mpi.Tags.MERGE)
+        if chunk:
+            file.write(chunk)
+        else:
+            followers -= 1
+
+
+def gather_chunks_pipelined(file: BinaryIO, samples: List[LocalGraph], chunk_size: int):
+    # A receive is always posted, so the followers' chunks arrive while this rank formats and writes
+    max_size = chunk_size + FORMAT_EDGES * MAX_LINE_LENGTH  # Chunks overflow the chunk size by less than a batch
+    followers = mpi.size - 1
+    receive = mpi.irecv_bytes(mpi.Tags.MERGE, max_size) if followers else None
+    for chunk in edge_chunks(samples, chunk_size):
+        file.write(chunk)
+    while followers:
+        _, chunk = receive.wait()
+        followers -= not chunk
+        if followers:
+            receive = mpi.irecv_bytes(mpi.Tags.MERGE, max_size)
+        file.write(chunk)
+
+
+def merge_samples_follower(samples: List[LocalGraph], chunk_size: int, pipelined: bool = False):
+    # When pipelined, the next chunk is formatted while the previous one is being sent
+    sending = None
+    for chunk in edge_chunks(samples, chunk_size):
+        if pipelined:
+            previous, sending = sending, mpi.isend_bytes(chunk, dest=0, tag=mpi.Tags.MERGE)
+            if previous:
+                previous.wait()
+        else:
+            mpi.send_bytes(chunk, dest=0, tag=mpi.Tags.MERGE)
+    if sending:
+        sending.wait()
+    mpi.send_bytes(b"", dest=0, tag=mpi.Tags.MERGE)
+
+
+def merge_mpiio(samples: List[LocalGraph], output_file: str, chunk_size: int, header: bool):
+    sources = np.concatenate([sample.sources for sample in samples])
+    targets = np.concatenate([sample.targets for sample in samples])
+    header_data = b""
+    if header:
+        # The distributor needs the edges sorted by source and the nodes/edges amounts
+        sources, targets = sort_globally(sources, targets)
+        nodes_amount, edges_amount = mpi.allreduce_sum([count_global_nodes(sources, targets), len(sources)])
+        header_data = "{}\n{}\n".format(nodes_amount, edges_amount).encode()
+    with mpi.CollectiveFile("{}.txt".format(output_file)) as file:
+        write_collective(file, 0, sources, targets, chunk_size, header_data)
+
+
+def write_collective(file: mpi.CollectiveFile, base_offset: int, sources: np.ndarray, targets: np.ndarray,
+                     chunk_size: int, header_data: bytes = b"") -> int:
+    # Writes the edges of every rank one after the other from base_offset, and returns where the written data ends
+    # Step 1: Every rank finds where its edges start with an exclusive prefix sum of the formatted sizes
+    line_ends = np.cumsum(line_lengths(sources, targets))
+    local_size = int(line_ends[-1]) if len(line_ends) else 0
+    offset = base_offset + len(header_data) + mpi.exscan_sum(local_size)
+    # Step 2: Write in bounded chunks, every rank joins the same amount of collective writes
+    bounds = chunk_bounds(line_ends, chunk_size)
+    writes_amount = mpi.allreduce_max([len(bounds) - 1, 1])[0]
+    total_size = mpi.allreduce_sum([local_size])[0]
+    for i in range(writes_amount):
+        if i < len(bounds) - 1:
+            start, end = bounds[i], bounds[i + 1]
+            data = format_edges(sources[start:end], targets[start:end])
+            chunk_offset = offset + (int(line_ends[start - 1]) if start else 0)
+        else:
+            data, chunk_offset = b"", offset
+        if i == 0 and mpi.rank == 0:
+            data, chunk_offset = header_data + data, chunk_offset - len(header_data)
+        file.write_at_all(chunk_offset, data)
+    return base_offset + len(header_data) + total_size
+
+
+def sort_globally(sources: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Sample sort: splitters are chosen from a sample of every rank's sources, and edges are sent to the rank owning
+    # their source range, so each source ends up in a single rank
+    sample = np.sort(sources)[np.linspace(0, len(sources) - 1, min(len(sources), SPLITTER_SAMPLES)).astype(np.int64)]
+    samples = np.sort(np.concatenate(mpi.allgather(sample)))
+    splitters = samples[np.arange(1, mpi.size) * len(samples) // mpi.size] if len(samples) else samples
+    destinations = np.searchsorted(splitters, sources, side="right")
+    edges = np.column_stack([sources, targets])
+    remote_edges = np.concatenate(mpi.alltoallv(
+        [e.ravel() for e in split_by_destination(edges, destinations, mpi.size)])).reshape(-1, 2)
+    order = np.argsort(remote_edges[:, 0], kind="stable")
+    return remote_edges[order, 0], remote_edges[order, 1]
+
+
+def count_global_nodes(sources: np.ndarray, targets: np.ndarray) -> int:
+    # Vertices are deduplicated by the rank they hash to
+    nodes = np.unique(np.concatenate([sources, targets]))
+    return len(np.unique(np.concatenate(mpi.alltoallv(split_by_destination(nodes, nodes % mpi.size, mpi.size)))))
+
+
+def line_lengths(sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    return digits_amount(sources) + digits_amount(targets) + 2
+
+
+def digits_amount(values: np.ndarray) -> np.ndarray:
+    digits = np.ones(len(values), dtype=np.int64)
+    power = 10
+    while len(values) and power <= values.max():
+        digits += values >= power
+        power *= 10
+    return digits
 
 
-def merge_samples_master(samples: List[nx.MultiDiGraph], output_file: str):
-    with open("{}.txt".format(output_file), "w") as file:
-        for sample in samples:
-            file.writelines(map(lambda e: "{} {}\n".format(e[0], e[1]), sample.edges))
-        for node in range(mpi.size):
-            if node != mpi.rank:
-                edges = mpi.comm.recv(source=node, tag=mpi.Tags.MERGE)
-                file.writelines(edges)
+def chunk_bounds(line_ends: np.ndarray, chunk_size: int) -> List[int]:
+    bounds = [0]
+    while bounds[-1] < len(line_ends):
+        written = int(line_ends[bounds[-1] - 1]) if bounds[-1] else 0
+        bounds.append(max(bounds[-1] + 1, int(np.searchsorted(line_ends, written + chunk_size, side="right"))))
+    return bounds
 
 
-def merge_samples_follower(samples: List[nx.MultiDiGraph]):
-    edges = []
+def edge_chunks(samples: List[LocalGraph], chunk_size: int) -> Iterator[bytes]:
+    chunk = []
+    chunk_len = 0
     for sample in samples:
-        edges.extend(map(lambda e: "{} {}\n".format(e[0], e[1]), sample.edges))
-    mpi.comm.send(edges, dest=0, tag=mpi.Tags.MERGE)
+        sources, targets = sample.sources, sample.targets
+        for start in range(0, len(sources), FORMAT_EDGES):
+            lines = format_edges(sources[start:start + FORMAT_EDGES], targets[start:start + FORMAT_EDGES])
+            chunk.append(lines)
+            chunk_len += len(lines)
+            if chunk_len >= chunk_size:
+                yield b"".join(chunk)
+                chunk = []
+                chunk_len = 0
+    if chunk:
+        yield b"".join(chunk)
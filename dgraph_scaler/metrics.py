@@ -0,0 +1,161 @@
+import json
+import pickle
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List
+
+import numpy as np
+
+
+class Recorder:
+    # Per-rank accumulator of phase wall times, communication volume, counters and memory high-water marks. Nothing is
+    # measured until it is enabled, so the instrumented calls only pay a flag check.
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self.memory = {}
+        self.communication = {}
+        self.counters = {}
+        self.running = {}  # Phase name to the threads inside it and since when
+        self.lock = threading.Lock()
+
+    def start_phase(self, name: str):
+        # A phase run by several threads at once counts the wall time during which any of them is inside it, not the
+        # sum of their times
+        with self.lock:
+            active, since = self.running.get(name, (0, time.perf_counter()))
+            self.running[name] = (active + 1, since)
+
+    def end_phase(self, name: str):
+        with self.lock:
+            active, since = self.running.pop(name)
+            if active > 1:
+                self.running[name] = (active - 1, since)
+                return
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - since
+            self.memory[name] = peak_memory()
+
+    def add_message(self, operation: str, nbytes: int, seconds: float):
+        with self.lock:
+            calls, total_bytes, total_seconds = self.communication.get(operation, (0, 0, 0.0))
+            self.communication[operation] = (calls + 1, total_bytes + nbytes, total_seconds + seconds)
+
+    def add_count(self, name: str, amount: int):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self) -> Dict:
+        return {
+            "phases": dict(self.phases),
+            "phase_memory_kib": dict(self.memory),
+            "peak_memory_kib": peak_memory(),
+            "communication": {operation: {"calls": calls, "bytes": nbytes, "seconds": seconds}
+                              for operation, (calls, nbytes, seconds) in self.communication.items()},
+            "counters": dict(self.counters),
+        }
+
+
+recorder = Recorder()
+
+
+def enable():
+    global recorder
+    recorder = Recorder()
+    recorder.enabled = True
+
+
+def enabled() -> bool:
+    return recorder.enabled
+
+
+@contextmanager
+def phase(name: str):
+    if not recorder.enabled:
+        yield
+        return
+    current = recorder
+    current.start_phase(name)
+    try:
+        yield
+    finally:
+        current.end_phase(name)
+
+
+def count(name: str, amount: int = 1):
+    if recorder.enabled:
+        recorder.add_count(name, int(amount))
+
+
+def measured(operation: str, argument: int = 0, received: bool = False):
+    # Wraps a communication helper, accounting the size of its payload argument, or of the data it returns for
+    # receives
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            payload = result[-1] if received else (args[argument] if len(args) > argument else None)
+            recorder.add_message(operation, payload_size(payload), time.perf_counter() - start)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def payload_size(payload) -> int:
+    if payload is None:
+        return 0
+    if isinstance(payload, np.ndarray):
+        return payload.nbytes
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    if isinstance(payload, (int, np.integer)):
+        return np.dtype(np.int64).itemsize
+    if isinstance(payload, (list, tuple)) and all(isinstance(item, (int, np.integer)) for item in payload):
+        return len(payload) * np.dtype(np.int64).itemsize
+    return len(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+
+
+def peak_memory() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+
+
+def summarize(reports: List[Dict]) -> Dict:
+    # Combines the reports of every rank, showing for each phase how far the slowest rank is from the mean
+    phases = {}
+    for name in sorted({name for report in reports for name in report["phases"]}):
+        seconds = np.array([report["phases"].get(name, 0.0) for report in reports])
+        phases[name] = {"min": float(seconds.min()), "max": float(seconds.max()), "mean": float(seconds.mean()),
+                        "imbalance": float(seconds.max() / seconds.mean()) if seconds.mean() else 1.0,
+                        "slowest_rank": int(seconds.argmax())}
+    communication = {}
+    for operation in sorted({operation for report in reports for operation in report["communication"]}):
+        stats = [report["communication"].get(operation, {"calls": 0, "bytes": 0, "seconds": 0.0})
+                 for report in reports]
+        communication[operation] = {"calls": sum(stat["calls"] for stat in stats),
+                                    "bytes": sum(stat["bytes"] for stat in stats),
+                                    "max_rank_seconds": max(stat["seconds"] for stat in stats)}
+    counters = {}
+    for report in reports:
+        for name, amount in report["counters"].items():
+            counters[name] = counters.get(name, 0) + amount
+    memory = [report["peak_memory_kib"] for report in reports]
+    return {
+        "ranks": len(reports),
+        "phases": phases,
+        "communication": communication,
+        "counters": counters,
+        "peak_memory_kib": {"max": max(memory), "mean": float(np.mean(memory)), "total": sum(memory)},
+        "per_rank": reports,
+    }
+
+
+def write_report(reports: List[Dict], path: str):
+    with open(path, "w") as file:
+        json.dump(summarize(reports), file, indent=2)
@@ -1,6 +1,14 @@
+import sys
+import types
 from enum import IntEnum
+from typing import Callable, List, Optional, Tuple
 
-from mpi4py import MPI
+import numpy as np
+
+from dgraph_scaler.metrics import measured
+from dgraph_scaler.typing import Communicator
+
+ANY_SOURCE = -1
 
 
 class NodeType(IntEnum):
@@ -18,15 +26,316 @@ class Tags(IntEnum):
     MERGE = 6
 
 
-PICKLE_SET_OVERHEAD = 31
-PICKLE_LIST_OVERHEAD = 6
-PICKLE_TUPLE_OVERHEAD = 3
-PICKLE_BIG_INT_OVERHEAD = 25
-MAX_NODES = 200000
+class Pending:
+    # Nonblocking operation in flight, wait() completes it and returns its result. The buffers in use are kept alive
+    # until then.
+    def __init__(self, complete: Callable[[], object], *buffers):
+        self.complete = complete
+        self.buffers = buffers
+
+    def wait(self):
+        return self.complete()
+
+
+class MPIBackend:
+    # Communication through mpi4py, which is only imported (initializing MPI) when the backend is created. Every
+    # backend offers the same operations on numpy buffers or small objects, and its duplicates are independent
+    # communication contexts.
+    def __init__(self, comm=None):
+        from mpi4py import MPI
+        self.MPI = MPI
+        self.comm = comm or MPI.COMM_WORLD
+        self.rank = self.comm.Get_rank()
+        self.size = self.comm.Get_size()
+
+    def duplicate(self) -> "MPIBackend":
+        return MPIBackend(self.comm.Dup())
+
+    def free(self):
+        self.comm.Free()
+
+    def alltoallv(self, send_buffer: np.ndarray, send_counts: np.ndarray,
+                  recv_counts: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        if recv_counts is None:
+            recv_counts = np.empty(self.size, dtype=np.int64)
+            self.comm.Alltoall(send_counts, recv_counts)
+        recv_buffer = np.empty(int(recv_counts.sum()), dtype=send_buffer.dtype)
+        self.comm.Alltoallv([send_buffer, (send_counts, displacements(send_counts))],
+                            [recv_buffer, (recv_counts, displacements(recv_counts))])
+        return recv_buffer, recv_counts
+
+    def ialltoallv(self, send_buffer: np.ndarray, send_counts: np.ndarray,
+                   recv_counts: Optional[np.ndarray]) -> Pending:
+        # Only the data travels in the background, the counts are exchanged at once if unknown
+        if recv_counts is None:
+            recv_counts = np.empty(self.size, dtype=np.int64)
+            self.comm.Alltoall(send_counts, recv_counts)
+        recv_buffer = np.empty(int(recv_counts.sum()), dtype=send_buffer.dtype)
+        send = [send_buffer, (send_counts, displacements(send_counts))]
+        recv = [recv_buffer, (recv_counts, displacements(recv_counts))]
+        request = self.comm.Ialltoallv(send, recv)
+
+        def complete():
+            request.Wait()
+            return recv_buffer, recv_counts
+
+        return Pending(complete, send, recv)
+
+    def neighbor_alltoallv(self, send_buffer: np.ndarray, send_counts: np.ndarray, sources: List[int],
+                           destinations: List[int]) -> np.ndarray:
+        topology = self.comm.Create_dist_graph_adjacent(sources, destinations, reorder=False)
+        recv_counts = np.empty(len(sources), dtype=np.int64)
+        topology.Neighbor_alltoall(send_counts, recv_counts)
+        recv_buffer = np.empty(int(recv_counts.sum()), dtype=send_buffer.dtype)
+        topology.Neighbor_alltoallv([send_buffer, (send_counts, displacements(send_counts))],
+                                    [recv_buffer, (recv_counts, displacements(recv_counts))])
+        topology.Free()
+        return recv_buffer
+
+    def allreduce(self, values: np.ndarray, operation: str) -> np.ndarray:
+        result = np.empty_like(values)
+        self.comm.Allreduce(values, result, op=self.MPI.SUM if operation == "sum" else self.MPI.MAX)
+        return result
+
+    def exscan_sum(self, value: int) -> int:
+        result = np.zeros(1, dtype=np.int64)
+        self.comm.Exscan(np.array([value], dtype=np.int64), result, op=self.MPI.SUM)
+        return int(result[0]) if self.rank else 0  # The result is undefined on the first rank
+
+    def alltoall(self, values: list) -> list:
+        return self.comm.alltoall(values)
+
+    def allgather(self, value) -> list:
+        return self.comm.allgather(value)
+
+    def allgatherv(self, send_buffer: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        recv_counts = np.empty(self.size, dtype=np.int64)
+        self.comm.Allgather(np.array([len(send_buffer)], dtype=np.int64), recv_counts)
+        recv_buffer = np.empty(int(recv_counts.sum()), dtype=send_buffer.dtype)
+        self.comm.Allgatherv(send_buffer, [recv_buffer, (recv_counts, displacements(recv_counts))])
+        return recv_buffer, recv_counts
+
+    def gather(self, value, root: int) -> Optional[list]:
+        return self.comm.gather(value, root=root)
+
+    def bcast(self, value, root: int):
+        return self.comm.bcast(value, root=root)
+
+    def thread_multiple(self) -> bool:
+        return self.MPI.Query_thread() == self.MPI.THREAD_MULTIPLE
+
+    def send_bytes(self, data: bytes, dest: int, tag: int):
+        self.comm.Send([data, self.MPI.BYTE], dest=dest, tag=tag)
+
+    def isend_bytes(self, data: bytes, dest: int, tag: int) -> Pending:
+        request = self.comm.Isend([data, self.MPI.BYTE], dest=dest, tag=tag)
+        return Pending(request.Wait, data)
+
+    def irecv_bytes(self, tag: int, max_size: int) -> Pending:
+        # Receives from any source into a buffer of max_size bytes, the message can't be larger
+        data = bytearray(max_size)
+        request = self.comm.Irecv([data, self.MPI.BYTE], source=self.MPI.ANY_SOURCE, tag=tag)
+
+        def complete():
+            status = self.MPI.Status()
+            request.Wait(status)
+            return status.Get_source(), memoryview(data)[:status.Get_count(self.MPI.BYTE)]
+
+        return Pending(complete)
+
+    def recv_bytes(self, tag: int, source: int) -> Tuple[int, bytearray]:
+        # The message size is probed first, so the receive buffer is allocated to fit it exactly
+        status = self.MPI.Status()
+        self.comm.Probe(source=self.MPI.ANY_SOURCE if source == ANY_SOURCE else source, tag=tag, status=status)
+        data = bytearray(status.Get_count(self.MPI.BYTE))
+        self.comm.Recv([data, self.MPI.BYTE], source=status.Get_source(), tag=tag)
+        return status.Get_source(), data
+
+    def open_file(self, path: str):
+        return MPIFile(self, path)
+
+
+class MPIFile:
+    def __init__(self, backend: MPIBackend, path: str):
+        self.MPI = backend.MPI
+        self.file = self.MPI.File.Open(backend.comm, path, self.MPI.MODE_WRONLY | self.MPI.MODE_CREATE)
+        self.file.Set_size(0)
+
+    def write_at_all(self, offset: int, data: bytes):
+        self.file.Write_at_all(offset, [data, self.MPI.BYTE])
+
+    def close(self):
+        self.file.Close()
+
+
+active_backend = None
+
+
+def backend() -> Communicator:
+    # MPI is the default, started on first use so importing the package does not initialize it
+    global active_backend
+    if active_backend is None:
+        active_backend = MPIBackend()
+    return active_backend
+
+
+def use_backend(new_backend: Communicator):
+    global active_backend
+    active_backend = new_backend
+
+
+def duplicate() -> Communicator:
+    return backend().duplicate()
+
+
+def alltoallv(send_arrays: List[np.ndarray], dtype=np.int64, communicator: Communicator = None) -> List[np.ndarray]:
+    send_buffer = np.concatenate(send_arrays).astype(dtype, copy=False) if send_arrays else np.empty(0, dtype)
+    recv_buffer, recv_counts = alltoallv_buffer(send_buffer, [len(array) for array in send_arrays],
+                                                communicator=communicator)
+    return np.split(recv_buffer, np.cumsum(recv_counts)[:-1])
+
+
+@measured("alltoallv")
+def alltoallv_buffer(send_buffer: np.ndarray, send_counts, recv_counts=None, communicator: Communicator = None) -> \
+        Tuple[np.ndarray, np.ndarray]:
+    # Counts are exchanged first (unless already known), then the data travels as a single contiguous buffer
+    # without pickling. The send buffer must be grouped by destination rank.
+    return (communicator or backend()).alltoallv(
+        send_buffer, np.asarray(send_counts, dtype=np.int64),
+        None if recv_counts is None else np.asarray(recv_counts, dtype=np.int64))
+
+
+def ialltoallv(send_arrays: List[np.ndarray], dtype=np.int64, communicator: Communicator = None) -> Pending:
+    # Nonblocking alltoallv, the pending exchange returns the received arrays
+    send_buffer = np.concatenate(send_arrays).astype(dtype, copy=False) if send_arrays else np.empty(0, dtype)
+    exchange = ialltoallv_buffer(send_buffer, [len(array) for array in send_arrays], communicator=communicator)
+
+    def complete():
+        recv_buffer, recv_counts = exchange.wait()
+        return np.split(recv_buffer, np.cumsum(recv_counts)[:-1])
+
+    return Pending(complete)
+
+
+@measured("ialltoallv")
+def ialltoallv_buffer(send_buffer: np.ndarray, send_counts, recv_counts=None,
+                      communicator: Communicator = None) -> Pending:
+    # Like alltoallv_buffer, but returns at once. The exchange completes, returning the same as alltoallv_buffer, when
+    # waited for. Exchanges on a communicator must be started in the same order on every rank.
+    return (communicator or backend()).ialltoallv(
+        send_buffer, np.asarray(send_counts, dtype=np.int64),
+        None if recv_counts is None else np.asarray(recv_counts, dtype=np.int64))
+
+
+@measured("neighbor_alltoallv")
+def neighbor_alltoallv(send_buffer: np.ndarray, send_counts: List[int], sources: List[int],
+                       destinations: List[int]) -> np.ndarray:
+    # Exchange only along the given directed links: the buffer is grouped by destination, and data is received from
+    # the sources
+    return backend().neighbor_alltoallv(send_buffer, np.asarray(send_counts, dtype=np.int64), sources, destinations)
+
+
+@measured("allreduce")
+def allreduce_sum(values: List[int], communicator: Communicator = None) -> List[int]:
+    return (communicator or backend()).allreduce(np.array(values, dtype=np.int64), "sum").tolist()
+
+
+@measured("allreduce")
+def allreduce_max(values: List[int]) -> List[int]:
+    return backend().allreduce(np.array(values, dtype=np.int64), "max").tolist()
+
+
+@measured("exscan")
+def exscan_sum(value: int) -> int:
+    return backend().exscan_sum(value)
+
+
+@measured("alltoall")
+def alltoall(values: list) -> list:
+    return backend().alltoall(values)
+
+
+@measured("allgather")
+def allgather(value, communicator: Communicator = None) -> list:
+    return (communicator or backend()).allgather(value)
+
+
+@measured("allgatherv")
+def allgatherv_buffer(send_buffer: np.ndarray, communicator: Communicator = None) -> Tuple[np.ndarray, np.ndarray]:
+    # Every rank receives the buffers of all the ranks concatenated, without pickling, along with their lengths
+    return (communicator or backend()).allgatherv(send_buffer)
+
+
+@measured("gather")
+def gather(value, root: int = 0) -> Optional[list]:
+    return backend().gather(value, root)
+
+
+@measured("bcast")
+def bcast(value, root: int = 0):
+    return backend().bcast(value, root)
+
+
+def thread_multiple() -> bool:
+    return backend().thread_multiple()
+
+
+@measured("send")
+def send_bytes(data: bytes, dest: int, tag: int):
+    backend().send_bytes(data, dest, tag)
+
+
+@measured("isend")
+def isend_bytes(data: bytes, dest: int, tag: int) -> Pending:
+    return backend().isend_bytes(data, dest, tag)
+
+
+def irecv_bytes(tag: int, max_size: int) -> Pending:
+    # The pending receive returns the source and the data received, from any source
+    return backend().irecv_bytes(tag, max_size)
+
+
+@measured("recv", received=True)
+def recv_bytes(tag: int, source: int = ANY_SOURCE) -> Tuple[int, bytearray]:
+    return backend().recv_bytes(tag, source)
+
+
+class CollectiveFile:
+    # Single file written in parallel by every rank, existing contents are discarded
+    def __init__(self, path: str):
+        self.file = backend().open_file(path)
+
+    @measured("write_at_all", argument=2)
+    def write_at_all(self, offset: int, data: bytes):
+        self.file.write_at_all(offset, data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def displacements(counts: np.ndarray) -> np.ndarray:
+    return np.cumsum(counts) - counts
+
+
+class LazyModule(types.ModuleType):
+    # comm, rank and size are looked up on the active backend, so they keep working as module attributes
+    @property
+    def comm(self) -> Communicator:
+        return backend()
+
+    @property
+    def rank(self) -> int:
+        return backend().rank
+
+    @property
+    def size(self) -> int:
+        return backend().size
 
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank()
-size = comm.Get_size()
 
-buf = MPI.Alloc_mem(MAX_NODES * PICKLE_BIG_INT_OVERHEAD + PICKLE_SET_OVERHEAD * size + MPI.BSEND_OVERHEAD * size)
-MPI.Attach_buffer(buf)
+sys.modules[__name__].__class__ = LazyModule
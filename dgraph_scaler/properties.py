@@ -0,0 +1,250 @@
+import os
+from itertools import starmap
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from dgraph_scaler.graph import connected_components, is_member
+from dgraph_scaler.util import read_edges_range
+
+READ_RANGE = 64 * 1024 * 1024  # Bytes of an edges file parsed by a single worker
+CLUSTERING_SAMPLES = 1000
+PATH_SAMPLES = 100
+EFFECTIVE_PERCENTILE = 0.9
+# The original columns come first, so results files written before the newer ones were added keep their layout
+PROPERTY_NAMES = ["Nodes", "Edges", "Connected", "Average-degree", "Average-clustering", "Average-sp", "Diameter",
+                  "Density", "Max-in-degree", "Max-out-degree", "Effective-diameter", "WCC", "Largest-WCC", "SCC"]
+
+# Adjacency shared with the pool workers, set once per worker by their initializer
+shared_offsets = None
+shared_neighbors = None
+
+
+class Graph:
+    # Directed simple graph with compact vertex ids 0..n-1, as a CSR of sorted out-neighbors
+    def __init__(self, sources: np.ndarray, targets: np.ndarray, nodes_amount: int):
+        keys = np.unique(sources * nodes_amount + targets)
+        self.nodes_amount = nodes_amount
+        self.sources = keys // nodes_amount if nodes_amount else keys
+        self.targets = keys % nodes_amount if nodes_amount else keys
+        self.offsets = csr_offsets(self.sources, nodes_amount)
+
+    @property
+    def edges_amount(self) -> int:
+        return len(self.sources)
+
+    def undirected(self) -> Tuple[np.ndarray, np.ndarray]:
+        # CSR of the undirected graph without self loops, for clustering
+        keep = self.sources != self.targets
+        sources = np.concatenate([self.sources[keep], self.targets[keep]])
+        targets = np.concatenate([self.targets[keep], self.sources[keep]])
+        keys = np.unique(sources * self.nodes_amount + targets)
+        return csr_offsets(keys // self.nodes_amount, self.nodes_amount), keys % self.nodes_amount
+
+
+def analyze(input_path: str, extension: Optional[str] = None, workers: Optional[int] = None,
+            clustering_samples: int = CLUSTERING_SAMPLES, path_samples: int = PATH_SAMPLES,
+            seed: Optional[int] = None) -> Dict:
+    rng = np.random.default_rng(seed)
+    workers = workers or os.cpu_count()
+    graph = load_graph(find_edge_files(input_path, extension), workers)
+    nodes, edges = graph.nodes_amount, graph.edges_amount
+    out_degrees = np.diff(graph.offsets)
+    in_degrees = np.bincount(graph.targets, minlength=nodes)
+    components = connected_components(graph.sources, graph.targets, nodes)
+    wcc_sizes = np.bincount(components)
+    wcc_sizes = wcc_sizes[wcc_sizes > 0]
+    effective_diameter, diameter, average_path = path_lengths(graph, path_samples, rng, workers)
+    return {
+        "Nodes": nodes,
+        "Edges": edges,
+        "Connected": len(wcc_sizes) == 1,
+        "Average-degree": edges / nodes if nodes else 0.0,
+        "Max-in-degree": int(in_degrees.max()) if nodes else 0,
+        "Max-out-degree": int(out_degrees.max()) if nodes else 0,
+        "Average-clustering": clustering_coefficient(graph, clustering_samples, rng, workers),
+        "Average-sp": average_path,
+        "Diameter": diameter,
+        "Effective-diameter": effective_diameter,
+        "Density": edges / (nodes * (nodes - 1)) if nodes > 1 else 0.0,
+        "WCC": len(wcc_sizes),
+        "Largest-WCC": int(wcc_sizes.max()) if nodes else 0,
+        "SCC": strong_components_amount(graph),
+    }
+
+
+def find_edge_files(input_path: str, extension: Optional[str] = None) -> List[str]:
+    if not os.path.isdir(input_path):
+        return [input_path]
+    return sorted(os.path.join(input_path, file) for file in os.listdir(input_path)
+                  if not extension or file.endswith(extension))
+
+
+def load_graph(paths: List[str], workers: int) -> Graph:
+    # Files are split in byte ranges parsed in parallel, and vertex ids are compacted at once for all the ranges
+    ranges = [(path, start, min(start + READ_RANGE, os.path.getsize(path)))
+              for path in paths for start in range(0, max(os.path.getsize(path), 1), READ_RANGE)]
+    if not ranges:
+        raise ValueError("No edge files found")
+    if workers == 1 or len(ranges) == 1:
+        edges = list(starmap(read_edges_range, ranges))
+    else:
+        with Pool(min(workers, len(ranges))) as pool:
+            edges = pool.starmap(read_edges_range, ranges)
+    values = np.concatenate([np.column_stack(range_edges).ravel() for range_edges in edges])
+    vertices, compact = np.unique(values, return_inverse=True)
+    compact = compact.reshape(-1)  # Some numpy versions keep the input shape
+    return Graph(compact[0::2], compact[1::2], len(vertices))
+
+
+def csr_offsets(sorted_sources: np.ndarray, nodes_amount: int) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(np.bincount(sorted_sources, minlength=nodes_amount))])
+
+
+def strong_components_amount(graph: Graph) -> int:
+    # Step 1: Trimming, vertices without incoming or outgoing edges are components by themselves
+    alive = np.ones(graph.nodes_amount, dtype=bool)
+    trimmed = 0
+    while True:
+        active = alive[graph.sources] & alive[graph.targets]
+        out_degrees = np.bincount(graph.sources[active], minlength=graph.nodes_amount)
+        in_degrees = np.bincount(graph.targets[active], minlength=graph.nodes_amount)
+        removed = alive & ((out_degrees == 0) | (in_degrees == 0))
+        if not removed.any():
+            break
+        alive &= ~removed
+        trimmed += int(removed.sum())
+    # Step 2: Tarjan on the remaining core, usually much smaller
+    remaining = np.flatnonzero(alive)
+    active = alive[graph.sources] & alive[graph.targets]
+    sources = np.searchsorted(remaining, graph.sources[active])
+    targets = np.searchsorted(remaining, graph.targets[active])
+    return trimmed + tarjan_components_amount(csr_offsets(sources, len(remaining)).tolist(), targets.tolist())
+
+
+def tarjan_components_amount(offsets: List[int], neighbors: List[int]) -> int:
+    # Iterative Tarjan, the work stack keeps every visited vertex with the position of its next edge
+    nodes_amount = len(offsets) - 1
+    index = [-1] * nodes_amount
+    low = [0] * nodes_amount
+    on_stack = [False] * nodes_amount
+    stack = []
+    counter = 0
+    components = 0
+    for root in range(nodes_amount):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [[root, offsets[root]]]
+        while work:
+            vertex, edge = work[-1]
+            if edge < offsets[vertex + 1]:
+                work[-1][1] += 1
+                neighbor = neighbors[edge]
+                if index[neighbor] == -1:
+                    index[neighbor] = low[neighbor] = counter
+                    counter += 1
+                    stack.append(neighbor)
+                    on_stack[neighbor] = True
+                    work.append([neighbor, offsets[neighbor]])
+                elif on_stack[neighbor]:
+                    low[vertex] = min(low[vertex], index[neighbor])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[vertex])
+            if low[vertex] == index[vertex]:
+                components += 1
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    if member == vertex:
+                        break
+    return components
+
+
+def clustering_coefficient(graph: Graph, samples: int, rng: np.random.Generator, workers: int) -> float:
+    # Average local clustering coefficient of a uniform sample of vertices, on the undirected graph
+    if not graph.nodes_amount:
+        return 0.0
+    offsets, neighbors = graph.undirected()
+    vertices = rng.choice(graph.nodes_amount, min(samples, graph.nodes_amount), replace=False)
+    coefficients = map_shared(local_clustering, vertices, offsets, neighbors, workers)
+    return float(np.mean(coefficients))
+
+
+def local_clustering(vertices: np.ndarray) -> np.ndarray:
+    coefficients = np.zeros(len(vertices))
+    for i, vertex in enumerate(vertices.tolist()):
+        vertex_neighbors = shared_neighbors[shared_offsets[vertex]:shared_offsets[vertex + 1]]
+        degree = len(vertex_neighbors)
+        if degree > 1:
+            # Every triangle is found once from each of its two other vertices
+            links = np.concatenate([shared_neighbors[shared_offsets[neighbor]:shared_offsets[neighbor + 1]]
+                                    for neighbor in vertex_neighbors.tolist()])
+            coefficients[i] = is_member(vertex_neighbors, links).sum() / (degree * (degree - 1))
+    return coefficients
+
+
+def path_lengths(graph: Graph, samples: int, rng: np.random.Generator, workers: int) -> Tuple[float, int, float]:
+    # Effective diameter, diameter and average shortest path length, from the BFS of a sample of source vertices
+    if not graph.nodes_amount:
+        return 0.0, 0, 0.0
+    sources = rng.choice(graph.nodes_amount, min(samples, graph.nodes_amount), replace=False)
+    histograms = map_shared(distance_histograms, sources, graph.offsets, graph.targets, workers)
+    histogram = np.zeros(max(len(histogram) for histogram in histograms), dtype=np.int64)
+    for partial in histograms:
+        histogram[:len(partial)] += partial
+    if not histogram.sum():
+        return 0.0, 0, 0.0
+    reached = np.cumsum(histogram)
+    target = EFFECTIVE_PERCENTILE * reached[-1]
+    distance = int(np.searchsorted(reached, target))
+    previous = reached[distance - 1] if distance else 0
+    effective = distance - 1 + (target - previous) / (reached[distance] - previous)
+    average = float(np.arange(len(histogram)) @ histogram / reached[-1])
+    return float(effective), len(histogram) - 1, average
+
+
+def distance_histograms(sources: np.ndarray) -> List[np.ndarray]:
+    # Amount of vertices at every distance >= 1 of each source, following the edges' direction. Frontiers are
+    # expanded at once.
+    histograms = []
+    degrees = np.diff(shared_offsets)
+    distances = np.full(len(degrees), -1, dtype=np.int64)
+    for source in sources.tolist():
+        distances[:] = -1
+        distances[source] = 0
+        frontier = np.array([source])
+        histogram = [0]
+        while len(frontier):
+            starts, lengths = shared_offsets[frontier], degrees[frontier]
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            reached = np.unique(shared_neighbors[positions])
+            frontier = reached[distances[reached] < 0]
+            distances[frontier] = len(histogram)
+            histogram.append(len(frontier))
+        histograms.append(np.array(histogram[:-1], dtype=np.int64))
+    return histograms
+
+
+def map_shared(function, values: np.ndarray, offsets: np.ndarray, neighbors: np.ndarray, workers: int) -> List:
+    # Splits the values among workers sharing the adjacency, which is sent once to every worker
+    chunks = [chunk for chunk in np.array_split(values, workers * 4) if len(chunk)]
+    if workers == 1:
+        share_adjacency(offsets, neighbors)
+        results = list(map(function, chunks))
+    else:
+        with Pool(workers, initializer=share_adjacency, initargs=(offsets, neighbors)) as pool:
+            results = pool.map(function, chunks)
+    return [item for result in results for item in result]
+
+
+def share_adjacency(offsets: np.ndarray, neighbors: np.ndarray):
+    global shared_offsets, shared_neighbors
+    shared_offsets, shared_neighbors = offsets, neighbors
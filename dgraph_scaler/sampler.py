@@ -1,73 +1,267 @@
-import random
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 from math import ceil
-from typing import List, Set, Tuple
-
-import networkx as nx
-
-from dgraph_scaler import mpi
-from dgraph_scaler.typing import Ownership, Edge, Vertex
-from dgraph_scaler.util import PartitionMap, choices
-
-
-def sample(graph: nx.MultiDiGraph, total_nodes: int, weight: float, partition_map: PartitionMap,
-           precision: float) -> nx.MultiDiGraph:
-    ownership_lens = [0] * mpi.size
-    ownerships = [set() for _ in range(mpi.size)]
-    sample = nx.MultiDiGraph()
-    candidate_edges = list(graph.edges)
-    while sum(ownership_lens) < total_nodes * precision:
-        # Step 1: Local random edges sampling
-        sub_sample, candidate_edges = local_edge_sampling(candidate_edges, (total_nodes - sum(ownership_lens)) * weight)
-        # Step 2: Calculate ownerships
-        ownership_lens = distribute_ownerships(sub_sample, ownerships, partition_map)
-        sample.add_edges_from(sub_sample.edges)
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from dgraph_scaler import mpi, compression, metrics
+from dgraph_scaler.filters import FilterOptions, VertexFilter
+from dgraph_scaler.graph import LocalGraph, is_member
+from dgraph_scaler.typing import Communicator, Ownership
+from dgraph_scaler.util import PartitionMap, split_by_destination
+
+RATE_RESOLUTION = 1e-6  # Seconds, shortest local sampling time used for the coverage rates
+PIPELINE_STAGES = 4  # Parts in which the induction queries travel when pipelined
+
+
+def sample(graph: LocalGraph, total_nodes: int, weight: float, partition_map: PartitionMap, precision: float,
+           rng: np.random.Generator, compress: bool = False, dynamic_quotas: bool = False,
+           induction_filter: Optional[FilterOptions] = None, pipelined: bool = False,
+           communicator: Communicator = None) -> LocalGraph:
+    ownership = np.empty(0, dtype=np.int64)
+    covered_nodes = 0
+    # Edges are sampled without replacement by consuming a random permutation of the local edges
+    edge_order = rng.permutation(graph.number_of_edges())
+    covered = np.zeros(graph.number_of_nodes(), dtype=bool)
+    cursor = 0
+    prepared = None
+    with metrics.phase("sampling"):
+        while covered_nodes < total_nodes * precision:
+            # Step 1: Local random edges sampling
+            sampling_t = time.perf_counter()
+            quota = (total_nodes - covered_nodes) * weight
+            new_nodes, cursor = local_edge_sampling(graph, edge_order, cursor, covered, quota, prepared)
+            rate = coverage_rate(len(new_nodes), time.perf_counter() - sampling_t, len(edge_order) - cursor)
+            # Step 2: Calculate ownerships, only for the vertices discovered in this round
+            if pipelined:
+                # The next round's first batch starts where this one ended, and is not larger than this round's
+                # first batch unless the quotas change, so it is drawn while the vertices travel
+                exchange = start_ownerships(new_nodes, partition_map, compress, communicator)
+                prepared = prepare_batch(graph, edge_order, cursor, covered, ceil(quota / 2))
+                ownership = finish_ownerships(exchange, ownership, compress)
+            else:
+                ownership = distribute_ownerships(new_nodes, ownership, partition_map, compress, communicator)
+            rates = [0] * mpi.size if dynamic_quotas else []
+            if dynamic_quotas:
+                rates[mpi.rank] = rate
+            covered_nodes, remaining_edges, *rates = mpi.allreduce_sum(
+                [len(ownership), len(edge_order) - cursor] + rates, communicator)
+            metrics.count("sampling_rounds")
+            if not remaining_edges:
+                break
+            # Ranks take a share of the next round proportional to how fast they covered vertices in this one
+            if dynamic_quotas and sum(rates):
+                weight = rates[mpi.rank] / sum(rates)
+    sampled_edges = edge_order[:cursor]
+    sample = LocalGraph(graph.sources[sampled_edges], graph.targets[sampled_edges])
     # Step 3: Distributed induction
-    distributed_induction(graph, sample, partition_map, ownerships[mpi.rank])
+    with metrics.phase("induction"):
+        distributed_induction(graph, sample, covered, sampled_edges, partition_map, ownership, rng, induction_filter,
+                              pipelined, communicator)
     return sample
 
 
-def local_edge_sampling(candidate_edges: List[Vertex], nodes_amount: int) -> Tuple[nx.MultiDiGraph, List[Vertex]]:
-    subgraph = nx.MultiDiGraph()
+def sample_parallel(graph: LocalGraph, nodes_amounts: List[int], weight: float, partition_map: PartitionMap,
+                    precision: float, rngs: List[np.random.Generator], compress: bool, workers: int,
+                    dynamic_quotas: bool = False, induction_filter: Optional[FilterOptions] = None,
+                    pipelined: bool = False) -> List[LocalGraph]:
+    # Samples are independent, so several run at once in threads sharing the read-only graph. Each thread has its own
+    # duplicated communicator, and runs its samples in a fixed order so collectives match across ranks. Threads only
+    # overlap while numpy or the communication release the GIL, so the speedup is far from one core per sample.
+    if not mpi.thread_multiple():
+        if mpi.rank == 0 and workers > 1:
+            warnings.warn("MPI does not support THREAD_MULTIPLE, samples are generated one at a time", RuntimeWarning)
+        workers = 1
+    workers = min(workers, len(nodes_amounts))
+    graph.endpoint_indices  # Fill the graph caches before the threads share it
+    communicators = [mpi.duplicate() for _ in range(workers)]
+    samples = [None] * len(nodes_amounts)
+
+    def run_worker(worker):
+        for i in range(worker, len(nodes_amounts), workers):
+            samples[i] = sample(graph, nodes_amounts[i], weight, partition_map, precision, rngs[i], compress,
+                                dynamic_quotas, induction_filter, pipelined, communicators[worker])
+
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(run_worker, range(workers)))
+    for communicator in communicators:
+        communicator.free()
+    return samples
+
+
+def coverage_rate(new_nodes: int, seconds: float, remaining_edges: int) -> int:
+    # New vertices per second, none if the rank ran out of edges
+    return int(new_nodes / max(seconds, RATE_RESOLUTION)) if remaining_edges else 0
+
+
+def local_edge_sampling(graph: LocalGraph, edge_order: np.ndarray, cursor: int, covered: np.ndarray,
+                        nodes_amount: float, prepared: Optional["PreparedBatch"] = None) -> Tuple[np.ndarray, int]:
+    sources, targets = graph.endpoint_indices
+    new_nodes = []
     nodes_sampled = 0
-    while nodes_sampled < nodes_amount:
-        subgraph.add_edges_from(choices(candidate_edges, k=ceil((nodes_amount - nodes_sampled) / 2)))
-        nodes_sampled = subgraph.number_of_nodes()
-    candidate_edges = list(filter(lambda e: not subgraph.has_edge(*e), candidate_edges))
-    return subgraph, candidate_edges
-
-
-def distribute_ownerships(sample: nx.MultiDiGraph, ownerships: List[Set[Vertex]], partition_map: PartitionMap) -> List[
-    int]:
-    for vertex in sample.nodes:
-        for owner in partition_map.get_owners(vertex):
-            ownerships[owner].add(vertex)
+    while nodes_sampled < nodes_amount and cursor < len(edge_order):
+        # Every edge covers at most two new vertices
+        batch = edge_order[cursor:cursor + ceil((nodes_amount - nodes_sampled) / 2)]
+        if prepared is not None and prepared.cursor == cursor and len(batch) <= len(prepared.sources):
+            endpoints = prepared.endpoints(len(batch))
+        else:
+            endpoints = np.concatenate([sources[batch], targets[batch]])
+            endpoints = endpoints[~covered[endpoints]]
+        prepared = None
+        cursor += len(batch)
+        batch_nodes = np.unique(endpoints)
+        covered[batch_nodes] = True
+        new_nodes.append(batch_nodes)
+        nodes_sampled += len(batch_nodes)
+    new_nodes = graph.nodes[np.concatenate(new_nodes)] if new_nodes else np.empty(0, dtype=graph.nodes.dtype)
+    return new_nodes, cursor
+
+
+class PreparedBatch(NamedTuple):
+    # Endpoints of the edges from cursor in the sampling order, and which of them were not covered yet
+    cursor: int
+    sources: np.ndarray
+    targets: np.ndarray
+    new_sources: np.ndarray
+    new_targets: np.ndarray
+
+    def endpoints(self, edges_amount: int) -> np.ndarray:
+        # Uncovered endpoints of the first edges, as the sampling would find them
+        return np.concatenate([self.sources[:edges_amount][self.new_sources[:edges_amount]],
+                               self.targets[:edges_amount][self.new_targets[:edges_amount]]])
+
+
+def prepare_batch(graph: LocalGraph, edge_order: np.ndarray, cursor: int, covered: np.ndarray,
+                  edges_amount: int) -> PreparedBatch:
+    sources, targets = graph.endpoint_indices
+    batch = edge_order[cursor:cursor + edges_amount]
+    batch_sources, batch_targets = sources[batch], targets[batch]
+    return PreparedBatch(cursor, batch_sources, batch_targets, ~covered[batch_sources], ~covered[batch_targets])
+
+
+def distribute_ownerships(vertices: np.ndarray, ownership: Ownership, partition_map: PartitionMap, compress: bool,
+                          communicator: Communicator = None) -> Ownership:
+    positions, owners = partition_map.get_owners_batch(vertices)
     # Step 2: Distribute ownerships
-    remote_ownerships = mpi.comm.alltoall(ownerships)
-    ownerships[mpi.rank] = ownerships[mpi.rank] | reduce(lambda o1, o2: o1 | o2, remote_ownerships)
-    ownership_lens = mpi.comm.alltoall([len(ownerships[mpi.rank])] * mpi.size)
-    return ownership_lens
-
-
-def distributed_induction(graph: nx.MultiDiGraph, sample: nx.MultiDiGraph, partition_map: PartitionMap,
-                          ownership: Set[Vertex]):
-    # Step 1: Get non-sampled edges non-owned nodes
-    edge_queries = [[] for _ in range(mpi.size)]
-    for edge in filter(lambda e: not sample.has_edge(*e) and sample.has_node(e[0]), graph.edges):
-        owners = partition_map.get_owners(edge[1])
-        edge_queries[random.choice(owners)].append(edge)  # Select only one of the owners randomly
-    # Step 2: Resolve induction of owned nodes
-    for edge in edge_queries[mpi.rank]:
-        if edge[1] in ownership:
-            sample.add_edge(*edge)
-    edge_queries[mpi.rank].clear()
-    # Step 3: Query each node's owner for
-    query_inductions(sample, edge_queries, ownership)
-
-
-def query_inductions(sample: nx.MultiDiGraph, edge_queries: List[List[Edge]], ownership: Ownership):
-    remote_queries = mpi.comm.alltoall(edge_queries)
-    answers = [list(filter(lambda e: e[1] in ownership, q)) for q in remote_queries]
-    remote_answers = mpi.comm.alltoall(answers)
-    for remote_answer in remote_answers:
-        sample.add_edges_from(remote_answer)
+    remote_ownerships = exchange_vertex_sets(split_by_destination(vertices[positions], owners, mpi.size), compress,
+                                             communicator)
+    return reduce(np.union1d, remote_ownerships, ownership)
+
+
+def start_ownerships(vertices: np.ndarray, partition_map: PartitionMap, compress: bool,
+                     communicator: Communicator = None) -> mpi.Pending:
+    positions, owners = partition_map.get_owners_batch(vertices)
+    vertex_sets = split_by_destination(vertices[positions], owners, mpi.size)
+    if compress:
+        return mpi.ialltoallv([compression.encode_set(vertex_set) for vertex_set in vertex_sets], dtype=np.uint8,
+                              communicator=communicator)
+    return mpi.ialltoallv(vertex_sets, communicator=communicator)
+
+
+def finish_ownerships(exchange: mpi.Pending, ownership: Ownership, compress: bool) -> Ownership:
+    remote_ownerships = exchange.wait()
+    if compress:
+        remote_ownerships = [compression.decode_set(remote_set) for remote_set in remote_ownerships]
+    return reduce(np.union1d, remote_ownerships, ownership)
+
+
+def exchange_vertex_sets(vertex_sets: List[np.ndarray], compress: bool, communicator: Communicator = None) -> List[
+    np.ndarray]:
+    if not compress:
+        return mpi.alltoallv(vertex_sets, communicator=communicator)
+    remote_sets = mpi.alltoallv([compression.encode_set(vertex_set) for vertex_set in vertex_sets], dtype=np.uint8,
+                                communicator=communicator)
+    return [compression.decode_set(remote_set) for remote_set in remote_sets]
+
+
+def distributed_induction(graph: LocalGraph, sample: LocalGraph, covered: np.ndarray, sampled_edges: np.ndarray,
+                          partition_map: PartitionMap, ownership: Ownership, rng: np.random.Generator,
+                          induction_filter: Optional[FilterOptions] = None, pipelined: bool = False,
+                          communicator: Communicator = None):
+    # Step 1: Get non-sampled edges whose source is sampled
+    sources, _ = graph.endpoint_indices
+    candidates = np.flatnonzero(covered[sources])
+    candidates = candidates[~is_member(np.sort(sampled_edges), candidates)]
+    candidates = candidates[~sample.has_edges(graph.sources[candidates], graph.targets[candidates])]  # Parallel edges
+    targets = graph.targets[candidates]
+    owners = partition_map.get_random_owners(targets, rng)  # Select only one of the owners randomly
+    # Step 2: Group the queries by owner, asking only once for every distinct target
+    order = np.lexsort((targets, owners))
+    distinct = np.ones(len(order), dtype=bool)
+    distinct[1:] = (np.diff(owners[order]) != 0) | (np.diff(targets[order]) != 0)
+    query_targets = targets[order][distinct]
+    query_counts = np.bincount(owners[order][distinct], minlength=mpi.size)
+    answers = np.zeros(len(query_targets), dtype=np.uint8)
+    asked = np.ones(len(query_targets), dtype=bool)
+    if induction_filter:
+        # Targets surely not sampled by their owner are answered locally, only the rest are confirmed
+        asked = screen_queries(query_targets, query_counts, ownership, induction_filter, communicator)
+        query_counts = np.bincount(owners[order][distinct][asked], minlength=mpi.size)
+        metrics.count("induction_screened", len(asked) - query_counts.sum())
+    metrics.count("induction_queries", query_counts.sum())
+    if pipelined:
+        answers[asked] = query_inductions_pipelined(query_targets[asked], query_counts, ownership, communicator)
+    else:
+        answers[asked] = query_inductions(query_targets[asked], query_counts, ownership, communicator)
+    # Step 3: Add the edges whose target was sampled
+    induced = np.empty(len(candidates), dtype=bool)
+    induced[order] = answers.astype(bool)[np.cumsum(distinct) - 1]
+    sample.add_edges(graph.sources[candidates[induced]], targets[induced])
+
+
+def screen_queries(query_targets: np.ndarray, query_counts: np.ndarray, ownership: Ownership,
+                   induction_filter: FilterOptions, communicator: Communicator = None) -> np.ndarray:
+    # Every rank publishes a filter of its sampled vertices, and queries are only kept if their owner's filter may
+    # contain the target. Queries must be grouped by owner. The bits travel as a single buffer, apart from the headers.
+    local_filter = VertexFilter.from_vertices(ownership, induction_filter)
+    headers = mpi.allgather(local_filter.header, communicator)
+    bits, bits_counts = mpi.allgatherv_buffer(local_filter.bits, communicator)
+    filters = [VertexFilter(header, filter_bits) for header, filter_bits in
+               zip(headers, np.split(bits, np.cumsum(bits_counts)[:-1]))]
+    return np.concatenate([np.empty(0, dtype=bool)] + [
+        vertex_filter.contains(targets) for vertex_filter, targets in
+        zip(filters, np.split(query_targets, np.cumsum(query_counts)[:-1]))])
+
+
+def query_inductions(query_targets: np.ndarray, query_counts: np.ndarray, ownership: Ownership,
+                     communicator: Communicator = None) -> np.ndarray:
+    # Owners answer every query with a single byte, in the same order they were asked
+    remote_targets, remote_counts = mpi.alltoallv_buffer(query_targets, query_counts, communicator=communicator)
+    answers, _ = mpi.alltoallv_buffer(is_member(ownership, remote_targets).astype(np.uint8), remote_counts,
+                                      recv_counts=query_counts, communicator=communicator)
+    return answers
+
+
+def query_inductions_pipelined(query_targets: np.ndarray, query_counts: np.ndarray, ownership: Ownership,
+                               communicator: Communicator = None) -> np.ndarray:
+    # Same answers as query_inductions, but the queries to every owner travel in stages, so every stage is answered
+    # while the next one is in flight, and the answers return while later stages are answered
+    size = len(query_counts)
+    owners = np.repeat(np.arange(size), query_counts)
+    starts = np.repeat(np.cumsum(query_counts) - query_counts, query_counts)
+    stages = (np.arange(len(query_targets)) - starts) * PIPELINE_STAGES // np.repeat(query_counts, query_counts)
+    order = np.lexsort((owners, stages))  # Grouped by stage and then by owner, in the original order within each
+    stage_counts = np.bincount(stages * size + owners, minlength=PIPELINE_STAGES * size).reshape(PIPELINE_STAGES, size)
+    # Step 1: The counts of every stage are exchanged at once
+    remote_counts, _ = mpi.alltoallv_buffer(stage_counts.T.ravel(), [PIPELINE_STAGES] * size,
+                                            communicator=communicator)
+    remote_counts = remote_counts.reshape(size, PIPELINE_STAGES).T
+    # Step 2: Send the next stage, answer the current one
+    stage_ends = np.cumsum(stage_counts.sum(axis=1))
+    stage_targets = np.split(query_targets[order], stage_ends[:-1])
+    queries = mpi.ialltoallv_buffer(stage_targets[0], stage_counts[0], remote_counts[0], communicator)
+    pending_answers = []
+    for stage in range(PIPELINE_STAGES):
+        current = queries
+        if stage + 1 < PIPELINE_STAGES:
+            queries = mpi.ialltoallv_buffer(stage_targets[stage + 1], stage_counts[stage + 1],
+                                            remote_counts[stage + 1], communicator)
+        remote_targets, _ = current.wait()
+        pending_answers.append(mpi.ialltoallv_buffer(is_member(ownership, remote_targets).astype(np.uint8),
+                                                     remote_counts[stage], stage_counts[stage], communicator))
+    answers = np.empty(len(query_targets), dtype=np.uint8)
+    answers[order] = np.concatenate([np.empty(0, dtype=np.uint8)] + [pending.wait()[0] for pending in pending_answers])
+    return answers
@@ -1,14 +1,24 @@
 import time
+import warnings
 from math import ceil
+from typing import Iterator, List, Optional, Tuple
 
-import networkx as nx
+import numpy as np
 
-from dgraph_scaler import distributor, sampler, util, mpi, stitcher, merger
+from dgraph_scaler import distributor, sampler, util, mpi, stitcher, merger, csr, connector, metrics, cache
+from dgraph_scaler.filters import DEFAULT_MAX_BITS, FilterOptions
+from dgraph_scaler.graph import LocalGraph
+from dgraph_scaler.merger import MergeType
 from dgraph_scaler.stitcher import StitchType
+from dgraph_scaler.util import LoadedInput, PartitionMap
 
 
 def scale(input_file, output_file, scale_factor, bridges=0.1, sampling_factor=0.5, precision=0.95, connect=False,
-          stitching_type="all-to-all", merge_nfs=False, verbose=True):
+          stitching_type="all-to-all", merge_type="centralized", verbose=True, seed=None, compress=False,
+          merge_buffer=16, merge_header=False, parallel_samples=1,
+          global_connect=False, metrics_file=None, stream=False, balance=False, dynamic_quotas=False,
+          cache_dir=None, filter_rate=None, filter_bits=DEFAULT_MAX_BITS, pipeline=False, merge_nfs=None):
+    merge_type = legacy_merge_type(merge_type, merge_nfs)
     if verbose and mpi.rank == 0:
         print("""
   ______  ______ _______  _____  _     _      _______ _______ _______        _______  ______
@@ -17,71 +27,120 @@ def scale(input_file, output_file, scale_factor, bridges=0.1, sampling_factor=0.
 """)
         print("▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬")
         print(
-            "Scale factor: {}. Bridges: {}%. Precision: {}%. Sampling factor: {}. Connect: {}. Stitching:{}. NFS: {}".format(
+            "Scale factor: {}. Bridges: {}%. Precision: {}%. Sampling factor: {}. Connect: {}. Stitching:{}. Merge: {}".format(
                 scale_factor,
                 bridges * 100,
                 precision * 100,
                 sampling_factor,
                 connect,
                 stitching_type,
-                merge_nfs), )
+                merge_type), )
         print("▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬")
         print()
 
     total_t = time.time()
-    # Step X: Parse sticthing type and check if valid
+    if metrics_file:
+        metrics.enable()
+    # Step X: Parse sticthing and merge types and check if valid
     stitching_type = StitchType.parse_type(stitching_type)
+    merge_type = MergeType.parse_type(merge_type)
+    induction_filter = FilterOptions(filter_rate, filter_bits) if filter_rate else None
+    if merge_header and merge_type != MergeType.MPI_IO:
+        raise ValueError("The merge header can only be written by the mpi-io merge")
+    if stream and (merge_header or global_connect):
+        raise ValueError("The merge header and the global connection need every sample, they can't be streamed")
+    # Step X: Seed every rank differently, but reproducibly if a seed is given
+    seed_sequence = np.random.SeedSequence(None if seed is None else [seed, mpi.rank])
+    rng = np.random.default_rng(seed_sequence)
 
     # Step X: Read distribute edges and load graph
     loading_t = time.time()
-    edges, partition_map, total_nodes = distributor.distribute_edges(input_file)
-    graph = util.load_graph_from_edges(edges)
-    edges = None  # Free memory
+    with metrics.phase("load"):
+        graph, partition_map, total_nodes = load(input_file, balance, cache_dir)
+    metrics.count("input_edges", graph.number_of_edges())
     if verbose and mpi.rank == 0:
         print("=================================")
         print("Loading time:", round(time.time() - loading_t, 2), "seconds")
         print("=================================")
     # Step X: Calculate weights (how many % of the nodes to sample) for each node
-    nodes_amount = mpi.comm.alltoall([graph.number_of_nodes()] * mpi.size)
-    weights = list(map(lambda a: ceil(a / sum(nodes_amount) * 100) / 100.0, nodes_amount))
+    with metrics.phase("weights"):
+        weights = sampling_weights(graph)
     # Step X: Split factor into sample rounds
-    sampling_factor = min(sampling_factor, scale_factor)
-    factors = [sampling_factor for _ in range(int(scale_factor / sampling_factor))]
-    remaining_factor = scale_factor - round(sum(factors), 2)
-    if remaining_factor:
-        factors.append(remaining_factor)
-    # Step X: Run distributed sampling
-    samples = []
-    for i, factor in enumerate(factors):
+    factors = split_factors(scale_factor, sampling_factor)
+    if stream:
+        # Step X: Sample, connect, relabel, stitch and write every sample as soon as it is produced
+        streaming_t = time.time()
+        with merger.StreamMerger(output_file, merge_type, merge_buffer * 1024 * 1024, pipeline) as writer:
+            for sources, targets in stream_samples(graph, partition_map, total_nodes, weights, factors, bridges,
+                                                   precision, connect, stitching_type, compress, parallel_samples,
+                                                   dynamic_quotas, induction_filter, pipeline, seed_sequence, rng):
+                metrics.count("output_edges", len(sources))
+                with metrics.phase("merge"):
+                    writer.write(sources, targets)
+        if verbose and mpi.rank == 0:
+            print("Streaming time {} samples:".format(len(factors)), round(time.time() - streaming_t, 2), "seconds")
+            print("=================================")
+        finish_metrics(metrics_file)
+        if verbose and mpi.rank == 0:
+            print("▬▬▬", "Total time:", round(time.time() - total_t, 2), "seconds", "▬▬▬▬")
+        return
+    # Step X: Run distributed sampling, every sample with its own random generator
+    rngs = [np.random.default_rng(sample_seed) for sample_seed in seed_sequence.spawn(len(factors))]
+    if parallel_samples > 1:
         sampling_t = time.time()
-        samples.append(sampler.sample(graph, int(total_nodes * factor), weights[mpi.rank], partition_map, precision))
+        samples = sampler.sample_parallel(graph, [int(total_nodes * factor) for factor in factors], weights[mpi.rank],
+                                          partition_map, precision, rngs, compress, parallel_samples, dynamic_quotas,
+                                          induction_filter, pipeline)
         if verbose and mpi.rank == 0:
-            print("Sampling time {}/{}:".format(i + 1, len(factors)), round(time.time() - sampling_t, 2), "seconds")
+            print("Sampling time {} samples:".format(len(factors)), round(time.time() - sampling_t, 2), "seconds")
+    else:
+        samples = []
+        for i, factor in enumerate(factors):
+            sampling_t = time.time()
+            samples.append(sampler.sample(graph, int(total_nodes * factor), weights[mpi.rank], partition_map,
+                                          precision, rngs[i], compress, dynamic_quotas, induction_filter,
+                                          pipeline))
+            if verbose and mpi.rank == 0:
+                print("Sampling time {}/{}:".format(i + 1, len(factors)), round(time.time() - sampling_t, 2),
+                      "seconds")
     if verbose and mpi.rank == 0:
         print("=================================")
     # Step X: Connect the graph
     if connect:
         connecting_t = time.time()
-        for sample in samples:
-            sample.add_edges_from(nx.k_edge_augmentation(nx.Graph(sample), 1))
+        with metrics.phase("connect"):
+            for sample in samples:
+                connector.connect_sample(sample)
         if verbose and mpi.rank == 0:
             print("Connecting time:", round(time.time() - connecting_t, 2), "seconds")
             print("=================================")
     # Step X: Rename vertices
     relabeling_t = time.time()
-    util.relabel_samples(samples)
+    with metrics.phase("relabel"):
+        util.relabel_samples(samples)
     if verbose and mpi.rank == 0:
         print("Relabeling time:", round(time.time() - relabeling_t, 2), "seconds")
         print("=================================")
     # Step X: Stitch samples locally and distributively
     stitching_t = time.time()
-    stitcher.stitch_samples(samples, bridges, stitching_type)
+    with metrics.phase("stitch"):
+        stitcher.stitch_samples(samples, bridges, stitching_type, rng)
     if verbose and mpi.rank == 0:
         print("Stiching time:", round(time.time() - stitching_t, 2), "seconds")
         print("=================================")
+    # Step X: Connect the stitched graph across ranks
+    if global_connect:
+        connecting_t = time.time()
+        with metrics.phase("global-connect"):
+            connector.connect_distributed(samples)
+        if verbose and mpi.rank == 0:
+            print("Global connecting time:", round(time.time() - connecting_t, 2), "seconds")
+            print("=================================")
     # Step X: Merge distributed samples into master file
     dumping_t = time.time()
-    merger.merge_samples(samples, output_file, merge_nfs)
+    metrics.count("output_edges", sum(sample.number_of_edges() for sample in samples))
+    with metrics.phase("merge"):
+        merger.merge_samples(samples, output_file, merge_type, merge_buffer * 1024 * 1024, merge_header, pipeline)
     if verbose and mpi.rank == 0:
         print("Dumping time:", round(time.time() - dumping_t, 2), "seconds")
         print("=================================")
@@ -91,3 +150,114 @@ def scale(input_file, output_file, scale_factor, bridges=0.1, sampling_factor=0.
     if verbose and mpi.rank == 0:
         print("▬▬▬", "Total time:", round(time.time() - total_t, 2), "seconds", "▬▬▬▬")
         print("▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬")
+    finish_metrics(metrics_file)
+
+
+def scale_stream(input_file, scale_factor, bridges=0.1, sampling_factor=0.5, precision=0.95, connect=False,
+                 stitching_type="all-to-all", seed=None, compress=False, parallel_samples=1, balance=False,
+                 dynamic_quotas=False, cache_dir=None, filter_rate=None, filter_bits=DEFAULT_MAX_BITS,
+                 pipeline=False) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    # Generator of the scaled graph as batches of (sources, targets) edges of this rank, which are not kept after
+    # being yielded. Every rank must consume the generator, as producing the batches is collective.
+    stitching_type = StitchType.parse_type(stitching_type)
+    seed_sequence = np.random.SeedSequence(None if seed is None else [seed, mpi.rank])
+    rng = np.random.default_rng(seed_sequence)
+    graph, partition_map, total_nodes = load(input_file, balance, cache_dir)
+    yield from stream_samples(graph, partition_map, total_nodes, sampling_weights(graph),
+                              split_factors(scale_factor, sampling_factor), bridges, precision, connect,
+                              stitching_type, compress, parallel_samples, dynamic_quotas,
+                              FilterOptions(filter_rate, filter_bits) if filter_rate else None, pipeline,
+                              seed_sequence, rng)
+
+
+def stream_samples(graph: LocalGraph, partition_map: PartitionMap, total_nodes: int, weights: List[float],
+                   factors: List[float], bridges: float, precision: float, connect: bool, stitching_type: StitchType,
+                   compress: bool, parallel_samples: int, dynamic_quotas: bool,
+                   induction_filter: Optional[FilterOptions], pipeline: bool, seed_sequence: np.random.SeedSequence,
+                   rng: np.random.Generator) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    # Samples are relabeled with a fixed stride, the global vertex range of the input, as the range of the samples
+    # still to come is unknown
+    span = mpi.allreduce_max([int(graph.nodes[-1]) if graph.number_of_nodes() else -1])[0] + 1
+    stitch = stitcher.StreamStitcher(len(factors), bridges, stitching_type, rng)
+    rngs = [np.random.default_rng(sample_seed) for sample_seed in seed_sequence.spawn(len(factors))]
+    # Only parallel_samples samples are held at once
+    for start in range(0, len(factors), parallel_samples):
+        indices = range(start, min(start + parallel_samples, len(factors)))
+        nodes_amounts = [int(total_nodes * factors[i]) for i in indices]
+        if len(indices) > 1:
+            samples = sampler.sample_parallel(graph, nodes_amounts, weights[mpi.rank], partition_map, precision,
+                                              [rngs[i] for i in indices], compress, parallel_samples, dynamic_quotas,
+                                              induction_filter, pipeline)
+        else:
+            samples = [sampler.sample(graph, nodes_amounts[0], weights[mpi.rank], partition_map, precision,
+                                      rngs[start], compress, dynamic_quotas, induction_filter, pipeline)]
+        for i, sample in zip(indices, samples):
+            if connect:
+                with metrics.phase("connect"):
+                    connector.connect_sample(sample)
+            with metrics.phase("relabel"):
+                sample.shift(i * span)
+            with metrics.phase("stitch"):
+                bridge_sources, bridge_targets = stitch.add_sample(i, sample)
+            yield np.concatenate([sample.sources, bridge_sources]), np.concatenate([sample.targets, bridge_targets])
+    with metrics.phase("stitch"):
+        bridge_sources, bridge_targets = stitch.finish()
+    yield bridge_sources, bridge_targets
+
+
+def legacy_merge_type(merge_type, merge_nfs) -> str:
+    # merge_type took the place of the merge_nfs flag, which older callers may still pass by name or position
+    if isinstance(merge_type, bool):
+        merge_nfs, merge_type = merge_type, "centralized"
+    if merge_nfs is not None:
+        warnings.warn("merge_nfs is deprecated, use merge_type='nfs' instead", DeprecationWarning, stacklevel=3)
+    # Only the default merge type can be overridden by the flag, an explicit different one is a contradiction
+    if merge_nfs and merge_type not in ("centralized", "nfs"):
+        raise ValueError("merge_nfs can't be combined with the {} merge".format(merge_type))
+    return "nfs" if merge_nfs else merge_type
+
+
+def load(input_file, balance: bool = False, cache_dir: Optional[str] = None) -> LoadedInput:
+    # The input can be loaded once and scaled many times: every scaling function also takes the result as input_file.
+    # With a cache_dir, the last input loaded stays in memory for the next calls until cache.clear() is called.
+    if isinstance(input_file, LoadedInput):
+        return input_file
+    if cache_dir:
+        return cache.load_cached(input_file, cache_dir, balance, lambda: load_input(input_file, balance))
+    return load_input(input_file, balance)
+
+
+def load_input(input_file: str, balance: bool = False) -> LoadedInput:
+    if csr.is_csr_file(input_file):
+        first_vertex, offsets, neighbors, partition_map, total_nodes = distributor.distribute_csr(input_file)
+        graph = util.load_graph_from_csr(first_vertex, offsets, neighbors)
+    else:
+        edges_data, partition_map, total_nodes = distributor.distribute_edges(input_file)
+        graph = util.load_graph_from_edges(edges_data)
+    if balance:
+        with metrics.phase("balance"):
+            graph, partition_map = distributor.rebalance(graph)
+    return LoadedInput(graph, partition_map, total_nodes)
+
+
+def sampling_weights(graph: LocalGraph) -> List[float]:
+    # Share of the nodes to sample in every rank
+    nodes_amount = mpi.alltoall([graph.number_of_nodes()] * mpi.size)
+    return list(map(lambda a: ceil(a / sum(nodes_amount) * 100) / 100.0, nodes_amount))
+
+
+def split_factors(scale_factor: float, sampling_factor: float) -> List[float]:
+    sampling_factor = min(sampling_factor, scale_factor)
+    factors = [sampling_factor for _ in range(int(scale_factor / sampling_factor))]
+    remaining_factor = scale_factor - round(sum(factors), 2)
+    if remaining_factor:
+        factors.append(remaining_factor)
+    return factors
+
+
+def finish_metrics(metrics_file: Optional[str]):
+    # Gather the per-rank measurements into a single report
+    if metrics_file:
+        reports = mpi.gather(metrics.recorder.report())
+        if mpi.rank == 0:
+            metrics.write_report(reports, metrics_file)
@@ -0,0 +1,259 @@
+import multiprocessing
+import os
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from dgraph_scaler import mpi
+
+SHARED_THRESHOLD = 64 * 1024  # Bytes from which arrays travel through a shared memory segment instead of the queue
+POLL_SECONDS = 0.1
+
+# Tags of the collectives, kept apart from the point-to-point ones in mpi.Tags. Every collective call is numbered too,
+# so several of them can be in flight at once.
+ALLTOALLV = -1
+NEIGHBOR = -2
+GATHER = -3
+BCAST = -4
+ALLTOALL = -5
+ALLGATHERV = -6
+
+
+class SharedArray:
+    # Reference to an array copied into a shared memory segment. The receiver copies it out and removes the segment.
+    def __init__(self, array: np.ndarray):
+        self.dtype = array.dtype
+        self.shape = array.shape
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, segment.buf)[...] = array
+        self.name = segment.name
+        segment.close()
+
+    def load(self) -> np.ndarray:
+        segment = shared_memory.SharedMemory(name=self.name)
+        array = np.ndarray(self.shape, self.dtype, segment.buf).copy()
+        segment.close()
+        segment.unlink()
+        return array
+
+
+class Mailbox:
+    # Messages arriving at this process, kept by communication context and tag until they are received. A thread
+    # drains the inbox queue, so senders never wait for the receiver.
+    def __init__(self, inbox: multiprocessing.Queue):
+        self.inbox = inbox
+        self.messages = {}
+        self.arrived = threading.Condition()
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            message = self.inbox.get()
+            if message is None:
+                return
+            context, tag, source, payload = message
+            if isinstance(payload, SharedArray):
+                payload = payload.load()
+            with self.arrived:
+                self.messages.setdefault((context, tag), []).append((source, payload))
+                self.arrived.notify_all()
+
+    def receive(self, context: tuple, tag: int, source: int) -> Tuple[int, object]:
+        # Messages from a given source are received in the order they were sent
+        with self.arrived:
+            while True:
+                pending = self.messages.get((context, tag), [])
+                for i, (sender, payload) in enumerate(pending):
+                    if source == mpi.ANY_SOURCE or sender == source:
+                        del pending[i]
+                        if not pending:
+                            del self.messages[(context, tag)]
+                        return sender, payload
+                self.arrived.wait()
+
+    def close(self):
+        self.inbox.put(None)
+        self.thread.join()
+
+
+class SharedMemoryBackend:
+    # Backend for the ranks of a single machine, running as processes launched by `launch`. Messages go through
+    # per-rank queues, large arrays through shared memory, and collectives are built from point-to-point messages.
+    def __init__(self, rank: int, size: int, inboxes: List[multiprocessing.Queue], mailbox: Mailbox = None,
+                 context: tuple = ()):
+        self.rank = rank
+        self.size = size
+        self.inboxes = inboxes
+        self.mailbox = mailbox or Mailbox(inboxes[rank])
+        self.context = context
+        self.duplicates = 0
+        self.collectives = 0
+
+    def duplicate(self) -> "SharedMemoryBackend":
+        # Duplicates are created in the same order on every rank, so their contexts match
+        self.duplicates += 1
+        return SharedMemoryBackend(self.rank, self.size, self.inboxes, self.mailbox,
+                                   self.context + (self.duplicates,))
+
+    def free(self):
+        pass
+
+    def collective_tag(self, kind: int) -> Tuple[int, int]:
+        # Collectives are called in the same order on every rank, so their numbers match
+        self.collectives += 1
+        return kind, self.collectives
+
+    def send(self, payload, dest: int, tag: int):
+        if isinstance(payload, (bytes, bytearray)) and len(payload) >= SHARED_THRESHOLD:
+            payload = np.frombuffer(payload, dtype=np.uint8)
+        if isinstance(payload, np.ndarray) and payload.nbytes >= SHARED_THRESHOLD:
+            payload = SharedArray(payload)
+        self.inboxes[dest].put((self.context, tag, self.rank, payload))
+
+    def receive(self, tag: int, source: int) -> Tuple[int, object]:
+        return self.mailbox.receive(self.context, tag, source)
+
+    def alltoallv(self, send_buffer: np.ndarray, send_counts: np.ndarray,
+                  recv_counts: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        return self.ialltoallv(send_buffer, send_counts, recv_counts).wait()
+
+    def ialltoallv(self, send_buffer: np.ndarray, send_counts: np.ndarray,
+                   recv_counts: Optional[np.ndarray]) -> mpi.Pending:
+        # Sends never block, so only the receives are left pending
+        tag = self.collective_tag(ALLTOALLV)
+        for part, dest in zip(np.split(send_buffer, np.cumsum(send_counts)[:-1]), range(self.size)):
+            self.send(part, dest, tag)
+
+        def complete():
+            received = [self.receive(tag, source)[1] for source in range(self.size)]
+            recv_buffer = np.concatenate(received).astype(send_buffer.dtype, copy=False)
+            return recv_buffer, np.array([len(part) for part in received], dtype=np.int64)
+
+        return mpi.Pending(complete)
+
+    def neighbor_alltoallv(self, send_buffer: np.ndarray, send_counts: np.ndarray, sources: List[int],
+                           destinations: List[int]) -> np.ndarray:
+        parts = np.split(send_buffer, np.cumsum(send_counts)[:-1]) if destinations else []
+        received = self.exchange(parts, sources, destinations, self.collective_tag(NEIGHBOR))
+        return np.concatenate(received).astype(send_buffer.dtype, copy=False) if received else \
+            np.empty(0, send_buffer.dtype)
+
+    def exchange(self, parts: list, sources: List[int], destinations: List[int], tag: Tuple[int, int]) -> list:
+        for part, dest in zip(parts, destinations):
+            self.send(part, dest, tag)
+        return [self.receive(tag, source)[1] for source in sources]
+
+    def allreduce(self, values: np.ndarray, operation: str) -> np.ndarray:
+        gathered = self.gather(values, 0)
+        reduced = None
+        if self.rank == 0:
+            reduced = (np.sum if operation == "sum" else np.max)(np.stack(gathered), axis=0).astype(values.dtype)
+        return self.bcast(reduced, 0)
+
+    def exscan_sum(self, value: int) -> int:
+        return sum(self.allgather(value)[:self.rank])
+
+    def alltoall(self, values: list) -> list:
+        return self.exchange(values, list(range(self.size)), list(range(self.size)), self.collective_tag(ALLTOALL))
+
+    def allgather(self, value) -> list:
+        return self.bcast(self.gather(value, 0), 0)
+
+    def allgatherv(self, send_buffer: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        ranks = list(range(self.size))
+        received = self.exchange([send_buffer] * self.size, ranks, ranks, self.collective_tag(ALLGATHERV))
+        recv_buffer = np.concatenate(received).astype(send_buffer.dtype, copy=False)
+        return recv_buffer, np.array([len(part) for part in received], dtype=np.int64)
+
+    def gather(self, value, root: int) -> Optional[list]:
+        tag = self.collective_tag(GATHER)
+        self.send(value, root, tag)
+        if self.rank != root:
+            return None
+        return [self.receive(tag, source)[1] for source in range(self.size)]
+
+    def bcast(self, value, root: int):
+        tag = self.collective_tag(BCAST)
+        if self.rank == root:
+            for dest in range(self.size):
+                if dest != root:
+                    self.send(value, dest, tag)
+            return value
+        return self.receive(tag, root)[1]
+
+    def barrier(self):
+        self.allgather(None)
+
+    def thread_multiple(self) -> bool:
+        return True
+
+    def send_bytes(self, data: bytes, dest: int, tag: int):
+        self.send(data, dest, tag)
+
+    def isend_bytes(self, data: bytes, dest: int, tag: int) -> mpi.Pending:
+        self.send(data, dest, tag)
+        return mpi.Pending(lambda: None)
+
+    def irecv_bytes(self, tag: int, max_size: int) -> mpi.Pending:
+        return mpi.Pending(lambda: self.recv_bytes(tag, mpi.ANY_SOURCE))
+
+    def recv_bytes(self, tag: int, source: int) -> Tuple[int, bytearray]:
+        sender, data = self.receive(tag, source)
+        return sender, bytearray(data)
+
+    def open_file(self, path: str):
+        return SharedFile(self, path)
+
+
+class SharedFile:
+    # Plain file written with positioned writes. It is truncated once, before any rank opens it.
+    def __init__(self, backend: SharedMemoryBackend, path: str):
+        self.backend = backend
+        if backend.rank == 0:
+            open(path, "wb").close()
+        backend.barrier()
+        self.fd = os.open(path, os.O_WRONLY)
+
+    def write_at_all(self, offset: int, data: bytes):
+        view = memoryview(data)
+        while len(view):
+            written = os.pwrite(self.fd, view, offset)
+            view, offset = view[written:], offset + written
+
+    def close(self):
+        os.close(self.fd)
+        self.backend.barrier()
+
+
+def launch(workers: int, function, args: tuple = (), kwargs: dict = None):
+    # Runs the function in as many processes as workers, each as one rank. If any of them fails, the others are
+    # stopped, as they would wait forever for its messages.
+    # Started before the ranks, so they share it and a segment created by one rank can be removed by another
+    resource_tracker.ensure_running()
+    inboxes = [multiprocessing.Queue() for _ in range(workers)]
+    processes = [multiprocessing.Process(target=run_rank, args=(rank, workers, inboxes, function, args, kwargs or {}))
+                 for rank in range(workers)]
+    for process in processes:
+        process.start()
+    pending = list(processes)
+    while pending:
+        pending[0].join(POLL_SECONDS)
+        failed = [process for process in pending if process.exitcode not in (None, 0)]
+        if failed:
+            for process in pending:
+                process.terminate()
+            raise RuntimeError("Rank {} failed with exit code {}".format(processes.index(failed[0]),
+                                                                         failed[0].exitcode))
+        pending = [process for process in pending if process.exitcode is None]
+
+
+def run_rank(rank: int, size: int, inboxes: List[multiprocessing.Queue], function, args: tuple, kwargs: dict):
+    backend = SharedMemoryBackend(rank, size, inboxes)
+    mpi.use_backend(backend)
+    function(*args, **kwargs)
+    # Nobody leaves while others may still be waiting for its messages
+    backend.barrier()
+    backend.mailbox.close()
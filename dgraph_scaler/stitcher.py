@@ -1,101 +1,221 @@
-import random
-from enum import Enum
-from typing import List
+from typing import Callable, List, Optional, Tuple
 
-import networkx as nx
+import numpy as np
 
 from dgraph_scaler import mpi
-from dgraph_scaler.util import choices
+from dgraph_scaler.graph import LocalGraph
 
 
-class StitchType(Enum):
-    ALL_TO_ALL = 0
-    RING = 1
+TOPOLOGIES = {}
+PARAMETERIZED_TOPOLOGIES = set()
+DEFAULT_RANDOM_DEGREE = 3
+
+
+def register_topology(name: str, parameterized: bool = False):
+    # Topologies map an amount of nodes (samples or ranks) to the directed links (i, j) that get bridges from i to j.
+    # Only parameterized ones accept a name:parameter stitching type. The generator they get is the same on every rank.
+    def decorator(topology: Callable[[int, Optional[int], np.random.Generator], List[Tuple[int, int]]]):
+        TOPOLOGIES[name] = topology
+        if parameterized:
+            PARAMETERIZED_TOPOLOGIES.add(name)
+        return topology
+
+    return decorator
+
+
+class StitchType:
+    def __init__(self, name: str, parameter: Optional[int] = None):
+        self.name = name
+        self.parameter = parameter
 
     @staticmethod
     def parse_type(raw_type: str):
-        if raw_type == "all-to-all":
-            return StitchType.ALL_TO_ALL
-        elif raw_type == "ring":
-            return StitchType.RING
-        else:
+        name, separator, parameter = raw_type.partition(":")
+        if name not in TOPOLOGIES:
             raise ValueError("Invalid sticthing type")
+        if not separator:
+            return StitchType(name)
+        if name not in PARAMETERIZED_TOPOLOGIES or not parameter.isdigit() or not int(parameter):
+            raise ValueError("Invalid sticthing type parameter: {}".format(raw_type))
+        return StitchType(name, int(parameter))
 
+    def links(self, nodes_amount: int, rng: np.random.Generator) -> List[Tuple[int, int]]:
+        return TOPOLOGIES[self.name](nodes_amount, self.parameter, rng)
 
-def stitch_samples(samples: List[nx.MultiDiGraph], bridges_percent: float, stitch_type: StitchType):
-    bridges_amount = int(samples[0].number_of_nodes() * bridges_percent)
-    # bridges_amount = int(min(samples[0].number_of_nodes(), samples[-1].number_of_nodes())*bridges_percent)
-    local_stitching(samples, bridges_amount, stitch_type)
-    distributed_stitching(samples, bridges_amount, stitch_type)
+    def __repr__(self):
+        return self.name if self.parameter is None else "{}:{}".format(self.name, self.parameter)
 
 
-def local_stitching(samples: List[nx.MultiDiGraph], bridges_amount: int, stitch_type: StitchType):
-    if stitch_type == StitchType.ALL_TO_ALL:
-        all_to_all_local_stitching(samples, bridges_amount)
-    elif stitch_type == StitchType.RING:
-        ring_local_stitching(samples, bridges_amount)
-    else:
-        raise ValueError("Invalid Stitching type")
+@register_topology("all-to-all")
+def all_to_all_topology(nodes_amount: int, _, __) -> List[Tuple[int, int]]:
+    return [(i, j) for i in range(nodes_amount) for j in range(nodes_amount) if i != j]
 
 
-def distributed_stitching(samples: List[nx.MultiDiGraph], bridges_amount: int, stitch_type: StitchType):
-    if stitch_type == StitchType.ALL_TO_ALL:
-        all_to_all_distributed_stitching(samples, bridges_amount)
-    elif stitch_type == StitchType.RING:
-        ring_distributed_stitching(samples, bridges_amount)
-    else:
-        raise ValueError("Invalid Stitching type")
+@register_topology("ring")
+def ring_topology(nodes_amount: int, _, __) -> List[Tuple[int, int]]:
+    return [(i, (i + 1) % nodes_amount) for i in range(nodes_amount) if nodes_amount > 1]
 
 
-def all_to_all_local_stitching(samples: List[nx.MultiDiGraph], bridges_amount: int):
-    samples_amount = len(samples)
-    if samples_amount < 2:
-        return
-    tails = [[choices(list(sample.nodes), k=bridges_amount) for _ in range(len(samples))] for sample in samples]
-    heads = [[choices(list(sample.nodes), k=bridges_amount) for _ in range(len(samples))] for sample in samples]
-    for i, sample in enumerate(samples):
-        for j in range(len(samples)):
-            if i != j:
-                sample.add_edges_from(zip(tails[i][j], heads[j][i]))
+@register_topology("hypercube")
+def hypercube_topology(nodes_amount: int, _, __) -> List[Tuple[int, int]]:
+    # Nodes differing in a single bit are linked, log2(n) neighbors each. Nodes beyond the last power of two just
+    # miss some links, but always keep the one towards the node without their highest bit.
+    dimensions = max(nodes_amount - 1, 0).bit_length()
+    return [(i, i ^ (1 << bit)) for i in range(nodes_amount) for bit in range(dimensions)
+            if i ^ (1 << bit) < nodes_amount]
 
 
-def all_to_all_distributed_stitching(samples: List[nx.MultiDiGraph], bridges_amount: int):
-    raw_samples = []
-    for sample in samples:
-        raw_samples.extend(sample.nodes)
-    random.shuffle(raw_samples)
-    my_remote_heads = [choices(raw_samples, k=bridges_amount) for _ in range(mpi.size)]
+@register_topology("random", parameterized=True)
+def random_topology(nodes_amount: int, degree: Optional[int], rng: np.random.Generator) -> List[Tuple[int, int]]:
+    # Union of k random directed cycles, so every node has k out-links and k in-links (fewer if cycles overlap)
+    links = set()
+    for _ in range(degree or DEFAULT_RANDOM_DEGREE):
+        cycle = rng.permutation(nodes_amount).tolist()
+        links.update((cycle[i], cycle[(i + 1) % nodes_amount]) for i in range(nodes_amount) if nodes_amount > 1)
+    return sorted(links)
 
-    tails = [choices(raw_samples, k=bridges_amount) for _ in range(mpi.size)]
-    remote_heads = mpi.comm.alltoall(my_remote_heads)
-    for i in range(mpi.size):
-        if i != mpi.rank:
-            bridges_amount_i = min(len(remote_heads[i]), len(tails[i]))
-            samples[0].add_edges_from(zip(remote_heads[i][:bridges_amount_i], tails[i][:bridges_amount_i]))
 
+@register_topology("star")
+def star_topology(nodes_amount: int, _, __) -> List[Tuple[int, int]]:
+    return [link for i in range(1, nodes_amount) for link in ((0, i), (i, 0))]
 
-def ring_local_stitching(samples: List[nx.MultiDiGraph], bridges_amount: int):
-    samples_amount = len(samples)
-    if samples_amount < 2:
+
+def stitch_samples(samples: List[LocalGraph], bridges_percent: float, stitch_type: StitchType,
+                   rng: np.random.Generator):
+    bridges_amount = int(samples[0].number_of_nodes() * bridges_percent)
+    # bridges_amount = int(min(samples[0].number_of_nodes(), samples[-1].number_of_nodes())*bridges_percent)
+    # Every rank must build the same topologies, the local one too as samples are spread across ranks
+    topology_rng = shared_rng(rng)
+    local_stitching(samples, bridges_amount, stitch_type, rng, topology_rng)
+    distributed_stitching(samples, bridges_amount, stitch_type, rng, topology_rng)
+
+
+def shared_rng(rng: np.random.Generator) -> np.random.Generator:
+    # Generator seeded by rank 0, identical on every rank
+    return np.random.default_rng(mpi.bcast(int(rng.integers(2 ** 63)) if mpi.rank == 0 else None))
+
+
+def local_stitching(samples: List[LocalGraph], bridges_amount: int, stitch_type: StitchType,
+                    rng: np.random.Generator, topology_rng: np.random.Generator):
+    local_bridges(samples, stitch_type.links(len(samples), topology_rng), bridges_amount, rng)
+
+
+def distributed_stitching(samples: List[LocalGraph], bridges_amount: int, stitch_type: StitchType,
+                          rng: np.random.Generator, topology_rng: np.random.Generator):
+    links = stitch_type.links(mpi.size, topology_rng)
+    destinations = [j for i, j in links if i == mpi.rank]
+    sources = [i for i, j in links if j == mpi.rank]
+    # Rank i sends random heads to every rank j it links to, which bridges them to random local tails. Only
+    # neighbors communicate.
+    nodes = np.concatenate([sample.nodes for sample in samples])
+    send_counts = [bridges_amount if len(nodes) else 0] * len(destinations)
+    my_remote_heads = nodes[rng.integers(len(nodes), size=sum(send_counts))] if len(nodes) else nodes
+    remote_heads = mpi.neighbor_alltoallv(my_remote_heads, send_counts, sources, destinations)
+    if len(nodes):
+        tails = nodes[rng.integers(len(nodes), size=len(remote_heads))]
+        samples[0].add_edges(remote_heads, tails)
+
+
+def local_bridges(samples: List[LocalGraph], links: List[Tuple[int, int]], bridges_amount: int,
+                  rng: np.random.Generator):
+    # Every (i, j) link adds bridges_amount edges from sample i to sample j, stored in sample i. The samples' node
+    # arrays are concatenated once and all the endpoints are drawn in a single call.
+    if not links:
         return
-    tails = [[choices(list(sample.nodes), k=bridges_amount) for _ in range(2)] for sample in samples]
-    heads = [[choices(list(sample.nodes), k=bridges_amount) for _ in range(2)] for sample in samples]
+    nodes = [sample.nodes for sample in samples]
+    sizes = np.array([len(sample_nodes) for sample_nodes in nodes], dtype=np.int64)
+    starts = np.cumsum(sizes) - sizes
+    all_nodes = np.concatenate(nodes)
+    links = np.array(sorted(links), dtype=np.int64)
+    links = links[(sizes[links[:, 0]] > 0) & (sizes[links[:, 1]] > 0)]
+    tail_samples = np.repeat(links[:, 0], bridges_amount)
+    head_samples = np.repeat(links[:, 1], bridges_amount)
+    draws = rng.random((2, len(tail_samples)))
+    tails = all_nodes[starts[tail_samples] + (draws[0] * sizes[tail_samples]).astype(np.int64)]
+    heads = all_nodes[starts[head_samples] + (draws[1] * sizes[head_samples]).astype(np.int64)]
+    bounds = np.searchsorted(tail_samples, np.arange(len(samples) + 1))
     for i, sample in enumerate(samples):
-        j = 0 if i == len(samples) - 1 else i + 1
-        if i != j:
-            sample.add_edges_from(zip(tails[i][0], heads[j][1]))
-
-
-def ring_distributed_stitching(samples: List[nx.MultiDiGraph], bridges_amount: int):
-    raw_samples = []
-    for sample in samples:
-        raw_samples.extend(sample.nodes)
-    random.shuffle(raw_samples)
-    my_remote_heads = [choices(raw_samples, k=bridges_amount) for _ in range(mpi.size)]
-
-    tails = [choices(raw_samples, k=bridges_amount) for _ in range(mpi.size)]
-    remote_heads = mpi.comm.alltoall(my_remote_heads)
-    for i in range(mpi.size):
-        if i != mpi.rank:
-            bridges_amount_i = min(len(remote_heads[i]), len(tails[i]))
-            samples[0].add_edges_from(zip(remote_heads[i][:bridges_amount_i], tails[i][:bridges_amount_i]))
+        if bounds[i] < bounds[i + 1]:
+            sample.add_edges(tails[bounds[i]:bounds[i + 1]], heads[bounds[i]:bounds[i + 1]])
+
+
+class StreamStitcher:
+    # Stitches samples as they are produced, without keeping them: only the random endpoints every sample contributes
+    # to its bridges are drawn and kept. Every rank must add the same samples in the same order.
+    def __init__(self, samples_amount: int, bridges_percent: float, stitch_type: StitchType,
+                 rng: np.random.Generator):
+        self.bridges_percent = bridges_percent
+        self.rng = rng
+        topology_rng = shared_rng(rng)
+        self.links = np.array(sorted(stitch_type.links(samples_amount, topology_rng)), dtype=np.int64).reshape(-1, 2)
+        # Position of every link among the out-links of its tail sample and among the in-links of its head sample
+        self.tail_slots = group_positions(self.links[:, 0])
+        self.head_slots = group_positions(self.links[:, 1])
+        rank_links = stitch_type.links(mpi.size, topology_rng)
+        self.destinations = [j for i, j in rank_links if i == mpi.rank]
+        self.sources = [i for i, j in rank_links if j == mpi.rank]
+        self.bridges_amount = None
+        self.tails = {}
+        self.heads = {}
+        self.nodes_seen = 0
+        self.remote_heads = None
+        self.remote_tails = None
+
+    def add_sample(self, index: int, sample: LocalGraph) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns the bridges between the samples added so far that this sample completes
+        nodes = sample.nodes
+        if index == 0:
+            self.start_distributed(len(nodes))
+        self.tails[index] = self.draw(nodes, int(np.sum(self.links[:, 0] == index)) * self.bridges_amount)
+        self.heads[index] = self.draw(nodes, int(np.sum(self.links[:, 1] == index)) * self.bridges_amount)
+        self.sample_pools(nodes)
+        sources, targets = [], []
+        completed = np.flatnonzero(self.links.max(axis=1) == index)
+        for (i, j), tail_slot, head_slot in zip(self.links[completed].tolist(), self.tail_slots[completed].tolist(),
+                                                self.head_slots[completed].tolist()):
+            if len(self.tails[i]) and len(self.heads[j]):
+                sources.append(self.tails[i][tail_slot * self.bridges_amount:(tail_slot + 1) * self.bridges_amount])
+                targets.append(self.heads[j][head_slot * self.bridges_amount:(head_slot + 1) * self.bridges_amount])
+        return concatenate_edges(sources, targets)
+
+    def finish(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Bridges between ranks, from the heads received from the linked ranks to random local tails
+        send_counts = [self.bridges_amount if self.nodes_seen else 0] * len(self.destinations)
+        remote_heads = mpi.neighbor_alltoallv(self.remote_heads[:sum(send_counts)], send_counts, self.sources,
+                                              self.destinations)
+        if not self.nodes_seen:
+            return concatenate_edges([], [])
+        return remote_heads, self.remote_tails[:len(remote_heads)]
+
+    def start_distributed(self, nodes_amount: int):
+        # The bridges amount depends on the first sample, so ranks learn how many heads they will receive once it is
+        # known, and size the pools of endpoints drawn from all their samples
+        self.bridges_amount = int(nodes_amount * self.bridges_percent)
+        bridges_amounts = mpi.allgather(self.bridges_amount)
+        self.remote_heads = np.empty(self.bridges_amount * len(self.destinations), dtype=np.int64)
+        self.remote_tails = np.empty(sum(bridges_amounts[source] for source in self.sources), dtype=np.int64)
+
+    def sample_pools(self, nodes: np.ndarray):
+        # Reservoir update: every pooled endpoint is replaced with the probability of being drawn from the new nodes,
+        # so the pools stay uniform over the nodes of every sample seen
+        self.nodes_seen += len(nodes)
+        for pool in (self.remote_heads, self.remote_tails):
+            replaced = np.flatnonzero(self.rng.random(len(pool)) < len(nodes) / max(self.nodes_seen, 1))
+            pool[replaced] = self.draw(nodes, len(replaced))
+
+    def draw(self, nodes: np.ndarray, amount: int) -> np.ndarray:
+        return nodes[self.rng.integers(len(nodes), size=amount)] if len(nodes) else nodes[:0]
+
+
+def group_positions(keys: np.ndarray) -> np.ndarray:
+    # Position of every element among the previous elements with the same key
+    order = np.argsort(keys, kind="stable")
+    positions = np.empty(len(keys), dtype=np.int64)
+    positions[order] = np.arange(len(keys)) - np.searchsorted(keys[order], keys[order])
+    return positions
+
+
+def concatenate_edges(sources: List[np.ndarray], targets: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    if not sources:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(sources), np.concatenate(targets)
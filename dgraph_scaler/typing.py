@@ -1,4 +1,6 @@
-from typing import List, Set, Tuple
+from typing import Any, List, Tuple
+
+import numpy as np
 
 
 RawEdge = str
@@ -7,5 +9,6 @@ Vertex = int
 Edge = Tuple[Vertex, Vertex]
 RawPartitionMap = List[Vertex]
 
-Ownership = Set[int]
-Ownerships = List[Ownership]
\ No newline at end of file
+Ownership = np.ndarray  # Sorted array of vertices
+Ownerships = List[Ownership]
+Communicator = Any  # Communication backend, see dgraph_scaler.mpi
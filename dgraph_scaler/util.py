@@ -1,61 +1,127 @@
-import itertools
-import random
-import string
-from bisect import bisect as _bisect
-from itertools import accumulate as _accumulate, repeat as _repeat
-from typing import List
+from bisect import bisect as _bisect, bisect_left as _bisect_left
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
 
-import networkx as nx
+import numpy as np
 
-from dgraph_scaler.typing import RawEdge, Vertex
+from dgraph_scaler import mpi
+from dgraph_scaler.graph import LocalGraph
+from dgraph_scaler.typing import Vertex
+
+MAX_VERTEX = np.iinfo(np.int64).max
 
 
 class PartitionMap:
+    # Partition ranges are sorted, so the owners of a vertex are always a contiguous run of partitions: from the first
+    # one whose last vertex is not below it, to the last one whose first vertex is not above it
     def __init__(self, partition_map):
         self.partition_map = partition_map
+        self.firsts = np.array([first for first, _ in partition_map], dtype=np.int64)
+        self.lasts = np.array([min(last, MAX_VERTEX) for _, last in partition_map], dtype=np.int64)
+        self._firsts = self.firsts.tolist()
+        self._lasts = self.lasts.tolist()
 
     def is_owner(self, machine, vertex):
         first, last = self.partition_map[machine]
         return first <= vertex <= last
 
     def get_owners(self, vertex) -> List[Vertex]:
-        return [i for i, l in enumerate(self.partition_map) if l[0] <= vertex <= l[1]]
+        return list(range(_bisect_left(self._lasts, vertex), _bisect(self._firsts, vertex)))
+
+    def get_owner_bounds(self, vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Owners of vertices[i] are the partitions in [lows[i], highs[i])
+        return np.searchsorted(self.lasts, vertices, side="left"), np.searchsorted(self.firsts, vertices, side="right")
+
+    def get_owners_batch(self, vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Every (position in vertices, owner) pair
+        lows, highs = self.get_owner_bounds(vertices)
+        amounts = highs - lows
+        positions = np.repeat(np.arange(len(vertices)), amounts)
+        owners = np.arange(len(positions)) - np.repeat(np.cumsum(amounts) - amounts, amounts) + lows[positions]
+        return positions, owners
+
+    def get_random_owners(self, vertices: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        lows, highs = self.get_owner_bounds(vertices)
+        return lows + (rng.random(len(vertices)) * (highs - lows)).astype(lows.dtype)
 
     def __repr__(self):
         return repr(self.partition_map)
 
 
-def load_graph_from_edges(edges: List[RawEdge]) -> nx.MultiDiGraph:
-    return nx.parse_edgelist(edges, nodetype=int, create_using=nx.MultiDiGraph)
-
-
-def relabel_samples(samples):
-    prefixes = [l for l in string.ascii_lowercase]
-    i = 2
-    while len(prefixes) < len(samples):
-        prefixes.extend(map(lambda n: "".join(n), itertools.permutations(string.ascii_lowercase, i)))
-        i += 1
-    for i in range(len(samples)):
-        prefix = prefixes[i]
-        edges = map(lambda e: (prefix + str(e[0]), prefix + str(e[1])), list(samples[i].edges))
-        samples[i] = g = nx.MultiDiGraph()
-        g.add_edges_from(edges)
-
-
-def choices(population, weights=None, *, cum_weights=None, k=1):
-    n = len(population)
-    if cum_weights is None:
-        if weights is None:
-            _int = int
-            n += 0.0  # convert to float for a small speed improvement
-            return [population[_int(random.random() * n)] for i in _repeat(None, k)]
-        cum_weights = list(_accumulate(weights))
-    elif weights is not None:
-        raise TypeError('Cannot specify both weights and cumulative weights')
-    if len(cum_weights) != n:
-        raise ValueError('The number of weights does not match the population')
-    bisect = _bisect
-    total = cum_weights[-1] + 0.0  # convert to float
-    hi = n - 1
-    return [population[bisect(cum_weights, random.random() * total, 0, hi)]
-            for i in _repeat(None, k)]
+class LoadedInput(NamedTuple):
+    # Partition of the input loaded by this rank, which can be scaled many times
+    graph: LocalGraph
+    partition_map: PartitionMap
+    total_nodes: int
+
+
+def load_graph_from_edges(data: bytes) -> LocalGraph:
+    return LocalGraph(*parse_edges(data))
+
+
+def load_graph_from_csr(first_vertex: Vertex, offsets: np.ndarray, neighbors: np.ndarray) -> LocalGraph:
+    return LocalGraph.from_csr(first_vertex, offsets, neighbors)
+
+
+def parse_edges(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    values = np.fromstring(data, dtype=np.int64, sep=" ")
+    if len(values) % 2:
+        raise ValueError("Edges must have exactly two vertices")
+    return values[0::2], values[1::2]
+
+
+def read_edges_range(path: str, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Edges of the lines starting within [start, end) of an edge list. Comment lines and the sorted inputs'
+    # nodes/edges header, two lines with a single value each, are skipped.
+    with open(path, "rb") as file:
+        if start:
+            file.seek(start - 1)
+            file.readline()
+        elif read_nodes_header(file) is not None:
+            file.readline()
+        data = file.read(max(end - file.tell(), 0))
+        if data and not data.endswith(b"\n"):
+            data += file.readline()
+    if b"#" in data:
+        data = b"\n".join(line for line in data.split(b"\n") if not line.lstrip().startswith(b"#"))
+    try:
+        return parse_edges(data)
+    except ValueError:
+        raise ValueError("Edges must have exactly two vertices: {}".format(path))
+
+
+def read_nodes_header(file: BinaryIO) -> Optional[int]:
+    # Nodes amount of the nodes/edges header, after any leading comments. The file is left at the line after it, or at
+    # the first edge if there is no header.
+    position = file.tell()
+    line = file.readline()
+    while line.lstrip().startswith(b"#"):
+        position = file.tell()
+        line = file.readline()
+    fields = line.split()
+    if len(fields) == 1:
+        return int(fields[0])
+    file.seek(position)
+    return None
+
+
+def format_edges(sources: np.ndarray, targets: np.ndarray) -> bytes:
+    return ("%d %d\n" * len(sources) % tuple(np.column_stack([sources, targets]).ravel().tolist())).encode()
+
+
+def split_by_destination(values: np.ndarray, destinations: np.ndarray, destinations_amount: int) -> List[np.ndarray]:
+    order = np.argsort(destinations, kind="stable")
+    bounds = np.cumsum(np.bincount(destinations, minlength=destinations_amount))[:-1]
+    return np.split(values[order], bounds)
+
+
+def relabel_samples(samples: List[LocalGraph]):
+    # Every sample gets a disjoint range of ids, as wide as the global range of its vertices. A sample is spread
+    # across ranks, so ranges are per sample and the same vertex keeps the same id in every rank.
+    firsts = [-int(sample.nodes[0]) if sample.number_of_nodes() else -MAX_VERTEX for sample in samples]
+    lasts = [int(sample.nodes[-1]) if sample.number_of_nodes() else -1 for sample in samples]
+    bounds = mpi.allreduce_max(firsts + lasts)
+    firsts = -np.array(bounds[:len(samples)], dtype=np.int64)
+    spans = np.maximum(np.array(bounds[len(samples):], dtype=np.int64) - firsts + 1, 0)
+    offsets = np.cumsum(spans) - spans  # Exclusive prefix sum of the spans
+    for sample, first, offset in zip(samples, firsts.tolist(), offsets.tolist()):
+        sample.shift(offset - first)
@@ -1,6 +1,10 @@
+import os
+import sys
+
 import click
 
 from dgraph_scaler import scaler
+from dgraph_scaler.filters import DEFAULT_MAX_BITS
 
 
 @click.command()
@@ -16,14 +20,68 @@ from dgraph_scaler import scaler
 @click.option('-p', '--precision',
               help="The minimum percentage of vertices that will be sampled compared to the expected amount. It is specified in percentage. 0.95 for 95%.",
               default=0.95, type=float)
-@click.option('-c', '--connect', is_flag=True, )
-@click.option('-st', '--stitching-type', help="Stitching topology used for connecting samples.", default="all-to-all",
+@click.option('-c', '--connect', help="Flag for connecting the components of every sample locally.", is_flag=True, )
+@click.option('-gc', '--global-connect', help="Flag for connecting the final stitched graph across all ranks.",
+              is_flag=True)
+@click.option('-st', '--stitching-type',
+              help="Stitching topology used for connecting samples: all-to-all, ring, hypercube, random[:degree] or "
+                   "star.", default="all-to-all", type=str)
+@click.option('-m', '--merge-type', help="How the output is written: centralized (the default), nfs or mpi-io.",
+              default=None, type=str)
+@click.option('-nfs', '--merge-nfs', help="Deprecated, same as --merge-type nfs.", is_flag=True, )
+@click.option('-hd', '--merge-header', help="Flag for writing the output sorted and with the nodes/edges header, so "
+                                            "it can be scaled again. Only for the mpi-io merge.", is_flag=True)
+@click.option('-mb', '--merge-buffer', help="Size in MiB of the chunks in which the output is streamed.", default=16,
+              type=int)
+@click.option('-ps', '--parallel-samples', help="Amount of samples generated concurrently within every rank, in "
+                                               "threads. They only overlap while numpy and MPI release the GIL, and "
+                                               "MPI must support THREAD_MULTIPLE, otherwise they run one at a time.",
+              default=1, type=int)
+@click.option('-sm', '--stream', help="Flag for writing every sample as soon as it is produced, instead of keeping "
+                                    "them all in memory until the merge.", is_flag=True)
+@click.option('-bl', '--balance', help="Flag for repartitioning the input by estimated cost (vertices, edges and "
+                                     "degree skew) instead of by bytes.", is_flag=True)
+@click.option('-dq', '--dynamic-quotas', help="Flag for resizing the per-rank sampling quotas every round, according "
+                                              "to how fast every rank covers vertices. The rates are measured in "
+                                              "wall-clock time, so runs are not reproducible with it, even with "
+                                              "--seed.", is_flag=True)
+@click.option('-cd', '--cache-dir', help="Folder where every rank keeps its parsed partition of the input, reused "
+                                       "by later runs with the same input and amount of ranks.", default=None,
               type=str)
-@click.option('-nfs', '--merge-nfs', help="Flag indicating if the output will be splitted in multiple files.",
-              is_flag=True, )
+@click.option('-if', '--induction-filter', 'filter_rate',
+              help="False positive rate of the filters of sampled vertices every rank publishes, so induction queries "
+                   "surely answered negatively are never sent. e.g. 0.01 for 1%. Disabled by default.", default=None,
+              type=float)
+@click.option('-ifb', '--induction-filter-bits', 'filter_bits',
+              help="Maximum size in bits of every rank's filter. Every rank receives the filters of all the ranks.",
+              default=DEFAULT_MAX_BITS, type=int)
+@click.option('-pl', '--pipeline', help="Flag for overlapping communication with computation: the next sampling "
+                                      "batch, induction queries and output chunks are prepared while the previous "
+                                      "ones are in flight. The output is the same.", is_flag=True)
 @click.option('-v', '--verbose', help="Flag for printing program progress.", is_flag=True)
-def distributed_sampling(*args, **kwargs):
-    scaler.scale(*args, **kwargs)
+@click.option('-z', '--compress', help="Flag for compressing the exchanged ownership sets.", is_flag=True)
+@click.option('-mt', '--metrics', 'metrics_file',
+              help="File where a JSON report with per-rank phase times, communication volume and peak memory is "
+                   "written.", default=None, type=str)
+@click.option('-be', '--backend', help="Communication backend: mpi, launched with mpirun, or shm, for running on a "
+                                      "single machine without MPI.", default="mpi", type=click.Choice(["mpi", "shm"]))
+@click.option('-w', '--workers', help="Amount of ranks launched by the shm backend. All the cores by default.",
+              default=None, type=int)
+@click.option('-s', '--seed', help="Seed for the random generators, for reproducible runs (except with "
+                                  "--dynamic-quotas).", default=None, type=int)
+def distributed_sampling(*args, merge_nfs, backend, workers, **kwargs):
+    if merge_nfs and kwargs["merge_type"] not in (None, "nfs"):
+        raise click.UsageError("--merge-nfs is the nfs merge, it can't be combined with --merge-type {}".format(
+            kwargs["merge_type"]))
+    kwargs["merge_type"] = "nfs" if merge_nfs else kwargs["merge_type"] or "centralized"
+    if backend == "shm":
+        # Shared memory segments are only available since Python 3.8, the mpi backend keeps working on older ones
+        if sys.version_info < (3, 8):
+            raise click.UsageError("The shm backend requires Python 3.8 or newer, use mpirun with the mpi backend")
+        from dgraph_scaler import shm
+        shm.launch(workers or os.cpu_count(), scaler.scale, args, kwargs)
+    else:
+        scaler.scale(*args, **kwargs)
 
 
 if __name__ == "__main__":
@@ -32,4 +90,8 @@ if __name__ == "__main__":
 """
 Command example:
 >  python3.6 main.py datasets/ordered/facebook.edges samples/facebook 2.5
+Binary CSR inputs (see scripts/convert_edges.py) are detected automatically:
+>  python3.6 main.py datasets/facebook.csr samples/facebook 2.5
+On a single machine, without mpirun:
+>  python3.8 main.py datasets/ordered/facebook.edges samples/facebook 2.5 --backend shm --workers 8
 """
@@ -0,0 +1,42 @@
+import inspect
+import os
+import sys
+from typing import Iterator, Tuple
+
+import click
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from dgraph_scaler import csr, util
+
+
+@click.command()
+@click.argument("input_file")
+@click.argument("output_file")
+@click.option("-p", "--partitions", default=1, type=int,
+              help="Amount of ranks the stored partition boundaries are computed for.")
+@click.option("-c", "--chunk-size", default=256, type=int, help="MiB of the input parsed at once. The input is read "
+                                                                "twice in chunks, only the offsets are kept in memory.")
+def convert_edges(input_file, output_file, partitions, chunk_size):
+    # Edge lists without the nodes/edges header have their vertices counted while converting
+    with open(input_file, "rb") as file:
+        vertices_amount = util.read_nodes_header(file)
+    csr.write_csr(output_file, lambda: read_chunks(input_file, chunk_size << 20), vertices_amount, partitions)
+
+
+def read_chunks(input_file: str, chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    # Lines belong to the chunk where they start, comments and the nodes/edges header are skipped
+    size = os.path.getsize(input_file)
+    for start in range(0, max(size, 1), chunk_size):
+        yield util.read_edges_range(input_file, start, min(start + chunk_size, size))
+
+
+if __name__ == "__main__":
+    convert_edges()
+
+"""
+Command example:
+> python3.6 scripts/convert_edges.py datasets/facebook.txt datasets/facebook.csr -p 4
+"""
@@ -0,0 +1,197 @@
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import numpy as np
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(parentdir, "main.py")
+DATASETS = [os.path.join(parentdir, "datasets", name) for name in ("facebook.txt", "p2p-Gnutella31.txt")]
+# Phases processing the input graph are measured against the input edges, the rest against the output edges
+INPUT_PHASES = ["load", "weights", "sampling", "induction"]
+COMPARED_METRICS = ["wall_seconds", "peak_memory_kib"]
+
+
+@click.group()
+def benchmarks():
+    pass
+
+
+@benchmarks.command()
+@click.argument("output_file")
+@click.argument("nodes", type=int)
+@click.option("-d", "--average-degree", default=10.0, type=float, help="Average out-degree of the vertices.")
+@click.option("-g", "--exponent", default=2.5, type=float, help="Exponent of the power-law degree distribution.")
+@click.option("-s", "--seed", default=0, type=int)
+def generate(output_file, nodes, average_degree, exponent, seed):
+    generate_power_law(output_file, nodes, average_degree, exponent, seed)
+
+
+@benchmarks.command()
+@click.argument("results_file")
+@click.option("-i", "--input-file", multiple=True, help="Sorted edge files to benchmark. The bundled datasets by "
+                                                        "default.")
+@click.option("-g", "--synthetic", multiple=True, type=int, help="Vertex amounts of synthetic power-law graphs to "
+                                                                 "generate and benchmark too.")
+@click.option("-n", "--ranks", multiple=True, type=int, default=[1, 2, 4])
+@click.option("-sc", "--scale-factors", multiple=True, type=float, default=[2.0])
+@click.option("-fs", "--sampling-factors", multiple=True, type=float, default=[0.5])
+@click.option("-st", "--stitching-types", multiple=True, default=["all-to-all"])
+@click.option("-r", "--repetitions", default=3, type=int, help="Runs of every configuration, the median is kept.")
+@click.option("-m", "--merge-type", default="mpi-io")
+@click.option("--mpirun", default="mpirun", help="Launcher command, extra flags can be included.")
+@click.option("-s", "--seed", default=0, type=int)
+def run(results_file, input_file, synthetic, ranks, scale_factors, sampling_factors, stitching_types, repetitions,
+        merge_type, mpirun, seed):
+    with tempfile.TemporaryDirectory() as workdir:
+        inputs = list(input_file) or DATASETS
+        for nodes in synthetic:
+            inputs.append(os.path.join(workdir, "power-law-{}.txt".format(nodes)))
+            generate_power_law(inputs[-1], nodes, 10.0, 2.5, seed)
+        results = []
+        for config in itertools.product(inputs, ranks, scale_factors, sampling_factors, stitching_types):
+            print("Running benchmark:", os.path.basename(config[0]), *config[1:])
+            measurements = [run_scaler(workdir, mpirun, merge_type, seed, *config) for _ in range(repetitions)]
+            results.append(dict(zip(["input", "ranks", "scale_factor", "sampling_factor", "stitching_type"],
+                                    [os.path.basename(config[0])] + list(config[1:])),
+                                **median_measurement(measurements)))
+    add_scaling_efficiency(results)
+    with open(results_file, "w") as file:
+        json.dump({"environment": environment(), "results": results}, file, indent=2)
+
+
+@benchmarks.command()
+@click.argument("baseline_file")
+@click.argument("candidate_file")
+@click.option("-t", "--threshold", default=0.1, type=float, help="Relative slowdown considered a regression. e.g. "
+                                                                 "0.1 for 10%.")
+def compare(baseline_file, candidate_file, threshold):
+    baseline, candidate = [{config_key(result): result for result in load_results(path)}
+                           for path in (baseline_file, candidate_file)]
+    regressions = 0
+    for key in sorted(set(baseline) & set(candidate), key=str):
+        before, after = baseline[key], candidate[key]
+        metrics = COMPARED_METRICS + ["phases.{}".format(phase) for phase in sorted(set(before["phases"]) &
+                                                                                     set(after["phases"]))]
+        for metric in metrics:
+            old, new = lookup(before, metric), lookup(after, metric)
+            change = new / old - 1 if old else 0.0
+            if change > threshold:
+                regressions += 1
+                print("REGRESSION", *key, metric, "{:.4g} -> {:.4g} ({:+.1%})".format(old, new, change))
+    missing = set(baseline) ^ set(candidate)
+    if missing:
+        print("Configurations present in only one of the runs:", len(missing))
+    print("Compared {} configurations, {} regressions".format(len(set(baseline) & set(candidate)), regressions))
+    sys.exit(1 if regressions else 0)
+
+
+def generate_power_law(output_file, nodes, average_degree, exponent, seed):
+    # Chung-Lu graph: endpoints are drawn proportionally to power-law vertex weights, so degrees follow the same law
+    rng = np.random.default_rng(seed)
+    weights = np.arange(1, nodes + 1, dtype=np.float64) ** (-1 / (exponent - 1))
+    weights /= weights.sum()
+    edges_amount = int(nodes * average_degree)
+    sources = rng.choice(nodes, edges_amount, p=weights)
+    targets = rng.choice(nodes, edges_amount, p=weights)
+    keep = sources != targets
+    edges = np.unique(np.column_stack([sources[keep], targets[keep]]), axis=0)
+    # Ids are made contiguous, and sorted by source as the scaler expects
+    vertices, edges = np.unique(edges, return_inverse=True)
+    edges = edges.reshape(-1, 2)
+    with open(output_file, "w") as file:
+        file.write("{}\n{}\n".format(len(vertices), len(edges)))
+        np.savetxt(file, edges, fmt="%d")
+
+
+def run_scaler(workdir, mpirun, merge_type, seed, input_file, ranks, scale_factor, sampling_factor, stitching_type):
+    output_file = os.path.join(workdir, "output")
+    metrics_file = os.path.join(workdir, "metrics.json")
+    command = mpirun.split() + ["-np", str(ranks), sys.executable, MAIN, input_file, output_file, str(scale_factor),
+                                "-fs", str(sampling_factor), "-st", stitching_type, "-m", merge_type, "-s", str(seed),
+                                "--metrics", metrics_file]
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    wall_seconds = time.perf_counter() - start
+    with open(metrics_file) as file:
+        report = json.load(file)
+    input_edges = report["counters"]["input_edges"]
+    output_edges = report["counters"]["output_edges"]
+    # A phase lasts as long as its slowest rank
+    phases = {name: stats["max"] for name, stats in report["phases"].items()}
+    return {
+        "wall_seconds": wall_seconds,
+        "input_edges": input_edges,
+        "output_edges": output_edges,
+        "edges_per_second": output_edges / wall_seconds,
+        "phases": phases,
+        "phase_edges_per_second": {name: (input_edges if name in INPUT_PHASES else output_edges) / seconds
+                                   for name, seconds in phases.items() if seconds},
+        "phase_imbalance": {name: stats["imbalance"] for name, stats in report["phases"].items()},
+        "peak_memory_kib": report["peak_memory_kib"]["max"],
+        "total_memory_kib": report["peak_memory_kib"]["total"],
+        "communication_bytes": sum(stats["bytes"] for stats in report["communication"].values()),
+    }
+
+
+def median_measurement(measurements):
+    if isinstance(measurements[0], dict):
+        keys = set.intersection(*[set(measurement) for measurement in measurements])
+        return {key: median_measurement([measurement[key] for measurement in measurements]) for key in sorted(keys)}
+    return float(np.median(measurements))
+
+
+def add_scaling_efficiency(results):
+    # Strong scaling efficiency against the smallest rank count run with the same configuration
+    groups = {}
+    for result in results:
+        groups.setdefault(config_key(result, with_ranks=False), []).append(result)
+    for group in groups.values():
+        base = min(group, key=lambda result: result["ranks"])
+        for result in group:
+            result["scaling_efficiency"] = (base["wall_seconds"] * base["ranks"]) / (
+                    result["wall_seconds"] * result["ranks"])
+
+
+def config_key(result, with_ranks=True):
+    return (result["input"], result["ranks"] if with_ranks else None, result["scale_factor"],
+            result["sampling_factor"], result["stitching_type"])
+
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)["results"]
+
+
+def lookup(result, metric):
+    for key in metric.split("."):
+        result = result[key]
+    return result
+
+
+def environment():
+    return {
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+        "commit": subprocess.run(["git", "rev-parse", "HEAD"], cwd=parentdir, stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL).stdout.decode().strip(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+if __name__ == "__main__":
+    benchmarks()
+
+"""
+Command example:
+> python3.6 scripts/run_benchmarks.py run results/baseline.json -g 100000 -n 1 -n 2 -n 4 -sc 2 -sc 5
+> python3.6 scripts/run_benchmarks.py compare results/baseline.json results/candidate.json -t 0.1
+"""
@@ -5,12 +5,11 @@ import shutil
 import sys
 
 import click
-import snap
 
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
-from dgraph_scaler import scaler, mpi
+from dgraph_scaler import scaler, mpi, properties
 
 
 @click.command()
@@ -28,24 +27,34 @@ from dgraph_scaler import scaler, mpi
 @click.option('-st', '--stitching-type', default="all-to-all", type=str)
 @click.option('-nfs', '--merge-nfs', is_flag=True, )
 @click.option('-v', '--verbose', is_flag=True)
+@click.option("-w", "--workers", default=None, type=int, help="Processes used for analyzing every scaled graph.")
+@click.option("-cd", "--cache-dir", default=None, help="Folder for keeping the parsed input between runs.")
 def run_properties_experiments(input_file, results_folder, output_file, measurements, scaling_factors, extension,
-                               append, bridges, sampling_factor, precision, connect, stitching_type, merge_nfs, verbose):
+                               append, bridges, sampling_factor, precision, connect, stitching_type, merge_nfs, verbose,
+                               workers, cache_dir):
+    # Checked by every rank before the first collective, so they all stop together
+    headers = existing_headers(output_file) if append else None
+    if headers is not None and headers != get_headers():
+        raise click.ClickException("The columns of {} don't match the current properties, write the results to a new "
+                                   "file instead".format(output_file))
     if mpi.rank == 0:
         if not os.path.exists(results_folder):
             os.makedirs(results_folder)
             clean_folder(results_folder)
         file = open(output_file, "a" if append else "w")
         csv_writer = csv.DictWriter(file, fieldnames=get_headers())
-        if not append:
+        if headers is None:
             csv_writer.writeheader()
+    # The input is parsed once and scaled for every experiment
+    loaded_input = scaler.load(input_file, cache_dir=cache_dir)
     for factor in scaling_factors:
         for i in range(measurements):
             if mpi.rank == 0:
                 print("Running experiment: {} - {}/{}".format(factor, i + 1, measurements), )
-            scaler.scale(input_file, results_folder, factor, bridges, sampling_factor, precision, connect, stitching_type, merge_nfs,
-                         verbose)
+            scaler.scale(loaded_input, os.path.join(results_folder, "sample"), factor, bridges, sampling_factor,
+                         precision, connect, stitching_type, "nfs" if merge_nfs else "centralized", verbose)
             if mpi.rank == 0:
-                row = get_properties_with_sanppy(extension, results_folder)
+                row = properties.analyze(results_folder, extension, workers)
                 row[csv_writer.fieldnames[0]] = factor
                 csv_writer.writerow(row)
                 file.flush()
@@ -64,45 +73,20 @@ def clean_folder(folder):
             shutil.rmtree(file_path)
 
 
+def existing_headers(output_file):
+    # Header row of a results file, None if there is no file to append to yet
+    if not os.path.exists(output_file) or not os.path.getsize(output_file):
+        return None
+    with open(output_file, newline="") as file:
+        return next(csv.reader(file), [])
+
+
 def get_headers():
     return ["Scaling-factor"] + get_property_names()
 
 
 def get_property_names():
-    return ["Nodes", "Edges", "Connected", "Average-degree", "Average-clustering", "Average-sp",
-            "Diameter", "Density"]
-
-
-def get_properties_with_sanppy(extension, input_folder):
-    id_map = {}
-    next_id = 0
-    graph = snap.PNGraph.New()
-    files_read = 0
-    for file in os.listdir(input_folder):
-        if not extension or file.endswith(extension):
-            files_read += 1
-            with open(os.path.join(input_folder, file)) as file:
-                for line in file.readlines():
-                    edge = line.rstrip().split()
-                    n1 = id_map.get(edge[0], next_id)
-                    if n1 == next_id:
-                        id_map[edge[0]] = n1
-                    next_id += 1
-                    n2 = id_map.get(edge[1], next_id)
-                    if n2 == next_id:
-                        id_map[edge[1]] = n2
-                    next_id += 1
-                    if not graph.IsNode(n1):
-                        graph.AddNode(n1)
-                    if not graph.IsNode(n2):
-                        graph.AddNode(n2)
-                    graph.AddEdge(n1, n2)
-    ef_diam_l, ef_diam_h, diam, sp = snap.GetBfsEffDiamAll(graph, 10, True)
-    properties = [snap.CntNonZNodes(graph), snap.CntUniqDirEdges(graph),
-                  snap.IsConnected(graph), snap.CntNonZNodes(graph) / snap.CntUniqDirEdges(graph),
-                  snap.GetClustCf(graph), sp, diam,
-                  snap.CntUniqDirEdges(graph) / (snap.CntNonZNodes(graph) * snap.CntNonZNodes(graph))]
-    return dict(zip(get_property_names(), properties))
+    return properties.PROPERTY_NAMES
 
 
 if __name__ == "__main__":
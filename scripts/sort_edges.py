@@ -1,21 +1,158 @@
+import inspect
 import os
+import shutil
+import sys
+import tempfile
+from collections import deque
+from multiprocessing import Pool
+from typing import Iterator, List, Optional, TextIO, Tuple
 
 import click
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from dgraph_scaler import util
+
+INDEX_EXTENSION = ".idx"  # Same sidecar the distributor reads
+# Offsets indexed by default across the whole file, so even with a thousand ranks every boundary has dozens of
+# candidate block starts around it
+INDEX_ENTRIES = 64 * 1024
 
 
 @click.command()
 @click.argument("input_file")
 @click.argument("output_file")
-@click.argument("vertices_amount")
-@click.argument("edges_amount")
-def order_merge_edges(input_file, output_file, vertices_amount, edges_amount):
-    with open(input_file) as file:
-        edges = file.readlines()
-    with open(output_file, "w") as file:
-        file.write(f"{vertices_amount}\n")
-        file.write(f"{edges_amount}\n")
-        edges.sort(key=lambda line: int(line.split()[0]))
-        file.writelines(edges)
+@click.option("-c", "--chunk-size", default=256, type=int, help="MiB of the input sorted at once by every worker.")
+@click.option("-m", "--merge-memory", default=256, type=int, help="MiB of sorted runs buffered while merging.")
+@click.option("-w", "--workers", default=None, type=int, help="Processes sorting chunks. All the cores by default.")
+@click.option("-t", "--tmp-dir", default=None, help="Folder for the sorted runs spilled to disk. The output folder by "
+                                                    "default.")
+@click.option("-i", "--index", is_flag=True, help="Flag for writing the byte offsets of the source-vertex blocks next "
+                                                  "to the output, for the distributor.")
+@click.option("-ib", "--index-gap", default=None, type=int,
+              help="Minimum bytes between two indexed offsets, 0 for indexing every block. By default the input size "
+                   "split in {} windows.".format(INDEX_ENTRIES))
+def order_merge_edges(input_file, output_file, chunk_size, merge_memory, workers, tmp_dir, index, index_gap):
+    if index_gap is None:
+        index_gap = os.path.getsize(input_file) // INDEX_ENTRIES
+    with tempfile.TemporaryDirectory(dir=tmp_dir or os.path.dirname(os.path.abspath(output_file))) as runs_dir, \
+            Pool(workers) as pool:
+        # Step 1: Parse and sort chunks in parallel, spilling every chunk as a sorted run
+        ranges = [(input_file, start, end, runs_dir) for start, end in byte_ranges(input_file, chunk_size << 20)]
+        runs = pool.map(sort_chunk, ranges)
+        edges_amount = sum(edges for _, _, edges in runs)
+        # Step 2: Count the distinct vertices by merging the runs' vertex sets
+        vertex_runs = [np.load(vertices, mmap_mode="r") for _, vertices, _ in runs]
+        nodes_amount = 0
+        last_vertex = None
+        for vertices in merge_runs(vertex_runs, merge_block(merge_memory, len(runs))):
+            distinct = np.unique(vertices[:, 0])
+            nodes_amount += len(distinct) - (distinct[0] == last_vertex if len(distinct) else 0)
+            last_vertex = distinct[-1] if len(distinct) else last_vertex
+        # Step 3: Merge the edge runs, formatting batches in parallel but writing them in order
+        edge_runs = [np.load(edges, mmap_mode="r") for edges, _, _ in runs]
+        last_source = None
+        last_bucket = None
+        # The offsets are spooled apart, as the index starts with the output's final size and modification time
+        offsets_path = os.path.join(runs_dir, "offsets")
+        with open(output_file, "wb") as file, open(offsets_path if index else os.devnull, "w") as index_file:
+            file.write("{}\n{}\n".format(nodes_amount, edges_amount).encode())
+            for sources, data in bounded_imap(pool, format_batch, merge_runs(edge_runs,
+                                                                             merge_block(merge_memory, len(runs))),
+                                              workers or os.cpu_count()):
+                if index:
+                    block_starts, last_source = find_block_starts(sources, data, last_source)
+                    last_bucket = write_index(index_file, file.tell() + block_starts, last_bucket, index_gap)
+                file.write(data)
+        if index:
+            write_stamped_index(output_file, offsets_path)
+
+
+def byte_ranges(input_file: str, range_size: int) -> List[Tuple[int, int]]:
+    size = os.path.getsize(input_file)
+    return [(start, min(start + range_size, size)) for start in range(0, max(size, 1), range_size)]
+
+
+def sort_chunk(task: Tuple[str, int, int, str]) -> Tuple[str, str, int]:
+    input_file, start, end, runs_dir = task
+    edges = np.column_stack(util.read_edges_range(input_file, start, end))
+    # Stable, so edges keep the input order within every source
+    edges = edges[np.argsort(edges[:, 0], kind="stable")]
+    vertices = np.unique(edges).reshape(-1, 1)
+    edges_path = os.path.join(runs_dir, "edges.{}.npy".format(start))
+    vertices_path = os.path.join(runs_dir, "vertices.{}.npy".format(start))
+    np.save(edges_path, edges)
+    np.save(vertices_path, vertices)
+    return edges_path, vertices_path, len(edges)
+
+
+def merge_block(merge_memory: int, runs_amount: int) -> int:
+    # Rows read at once from every run, so all the buffers fit in the merge memory
+    return max(1024, (merge_memory << 20) // (16 * max(runs_amount, 1)))
+
+
+def merge_runs(runs: List[np.ndarray], block: int) -> Iterator[np.ndarray]:
+    # K-way merge of runs sorted by their first column. Every step emits, at once, the buffered rows up to the
+    # smallest last key among the runs that still have rows on disk, as no later row can precede them.
+    positions = [min(block, len(run)) for run in runs]
+    buffers = [np.asarray(run[:position]) for run, position in zip(runs, positions)]
+    while any(len(buffer) for buffer in buffers):
+        pending = [buffer[-1, 0] for run, buffer, position in zip(runs, buffers, positions) if position < len(run)]
+        cutoff = min(pending) if pending else None
+        parts = []
+        for i, buffer in enumerate(buffers):
+            emitted = len(buffer) if cutoff is None else int(np.searchsorted(buffer[:, 0], cutoff, side="right"))
+            parts.append(buffer[:emitted])
+            buffers[i] = buffer[emitted:]
+        merged = np.concatenate(parts)
+        yield merged[np.argsort(merged[:, 0], kind="stable")]
+        for i, run in enumerate(runs):
+            if positions[i] < len(run) and len(buffers[i]) < block:
+                buffers[i] = np.concatenate([buffers[i], run[positions[i]:positions[i] + block]])
+                positions[i] = min(positions[i] + block, len(run))
+
+
+def bounded_imap(pool: Pool, function, values: Iterator, workers: int) -> Iterator:
+    # Like Pool.imap, but only a few values are read ahead, so the merged batches are not all held in memory
+    pending = deque()
+    for value in values:
+        pending.append(pool.apply_async(function, (value,)))
+        if len(pending) > 2 * workers:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def format_batch(edges: np.ndarray) -> Tuple[np.ndarray, bytes]:
+    return edges[:, 0], ("%d %d\n" * len(edges) % tuple(edges.ravel().tolist())).encode()
+
+
+def find_block_starts(sources: np.ndarray, data: bytes, last_source) -> Tuple[np.ndarray, int]:
+    # Byte offsets, within the batch, of the lines starting a new source vertex
+    line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n")) + 1
+    line_starts = np.concatenate([[0], line_ends[:-1]])
+    previous = np.concatenate([[-1 if last_source is None else last_source], sources[:-1]])
+    starts = line_starts[sources != previous]
+    return starts, (sources[-1] if len(sources) else last_source)
+
+
+def write_index(index_file: TextIO, offsets: np.ndarray, last_bucket: Optional[int], gap: int) -> Optional[int]:
+    # The distributor only needs block starts near its byte boundaries, so only the first block starting in every
+    # gap-sized window of the file is kept
+    buckets = offsets // gap if gap else offsets
+    keep = buckets != np.concatenate([[-1 if last_bucket is None else last_bucket], buckets[:-1]])
+    index_file.writelines("{}\n".format(offset) for offset in offsets[keep].tolist())
+    return int(buckets[-1]) if len(buckets) else last_bucket
+
+
+def write_stamped_index(output_file: str, offsets_path: str):
+    # The distributor ignores the index if the edges file no longer has this size and modification time
+    stat = os.stat(output_file)
+    with open(output_file + INDEX_EXTENSION, "w") as index_file, open(offsets_path) as offsets_file:
+        index_file.write("# {} {}\n".format(stat.st_size, stat.st_mtime_ns))
+        shutil.copyfileobj(offsets_file, index_file)
 
 
 if __name__ == "__main__":
@@ -23,5 +160,5 @@ if __name__ == "__main__":
 
 """
 Command example:
-> python3.6 scripts/sort_edges.py datasets/facebook datasets/ordered/facebook.edges -e ".edges"
+> python3.6 scripts/sort_edges.py datasets/facebook datasets/ordered/facebook.edges -i
 """